@@ -0,0 +1,30 @@
+"""
+Helpers upon asyncio shared by the asynchronous emulators.
+"""
+import asyncio
+import os
+
+
+async def write_fd(fd, data):
+    """
+    Writes all data into a non-blocking file descriptor
+
+    Whenever the descriptor would block, the event loop gets asked for a
+    writer callback upon it, so waiting costs no thread at all.
+    """
+    loop = asyncio.get_running_loop()
+    view = memoryview(data)
+    while view:
+        try:
+            view = view[os.write(fd, view):]
+            continue
+        except BlockingIOError:
+            pass
+
+        writable = loop.create_future()
+        loop.add_writer(
+            fd, lambda: writable.done() or writable.set_result(None))
+        try:
+            await writable
+        finally:
+            loop.remove_writer(fd)
@@ -1,11 +1,7 @@
 import logging
-import sys
-import os
 
 from custom.profile import ProfileTree, ProfileReader
-
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "ps")))
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "kb")))
+from ctrl.registry import registry
 
 class CtrlError(Exception):
     def __init__(self, message = None):
@@ -21,7 +17,10 @@ class Ctrl(object):
     """
     Emulator control class.
     """
-    
+
+    # Module attribute naming the class to be implemented
+    IMPT_ATTR = "impt_class"
+
     def __init__(self, logger, ctrl_info=None):
         self.logger = logger
 
@@ -57,19 +56,12 @@ class Ctrl(object):
 
         try:
             self.logger.debug("attempting the import of {0} library".format(m))
-            hw_mod = __import__(m)
-
-            if not hasattr(hw_mod, "impt_class"):
-                msg = "module {0} has no impt_class attribute".format(m)
-                raise CtrlModuleError(msg)
-
-            cname = getattr(hw_mod, "impt_class")
-
-            if not hasattr(hw_mod, cname):
-                msg = "module {0} has no {1} class implemented".format(m, cname)
-                raise CtrlModuleError(msg)
+            try:
+                hw_class = registry.resolve(m, self.IMPT_ATTR)
+            except LookupError as e:
+                raise CtrlModuleError(str(e))
 
-            self.model = getattr(hw_mod, cname)(
+            self.model = hw_class(
                 self.logger,
                 **setup_kwargs(
                     ProfileReader.get_content(
@@ -1,6 +1,8 @@
 from abc import ABCMeta, abstractmethod
 from ctrl.ctrl import CtrlError
 
+import contextlib
+
 class KbGen(metaclass=ABCMeta):
     """
     Keyboard emulator controller base class.
@@ -28,6 +30,33 @@ class KbGen(metaclass=ABCMeta):
         "Release device resources of connection"
 
 
+class AsyncKbGen(metaclass=ABCMeta):
+    """
+    Asynchronous keyboard emulator controller base class.
+
+    Counterpart of KbGen whose methods are coroutines, so one event loop
+    can drive several keyboards at once
+    """
+
+    def  __init__(self, logger, *args, **kwargs):
+        self.logger = logger
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    @abstractmethod
+    async def open(self):
+        "Open device connection"
+
+    @abstractmethod
+    async def perform(self, seq):
+        "Type instructions from a sequence"
+
+    @abstractmethod
+    async def release(self):
+        "Release device resources of connection"
+
+
 class KbHwError(CtrlError):
     def __init__(self, message = None, module = None):
         self.HW_module = module
@@ -55,6 +84,14 @@ class PsGen(metaclass=ABCMeta):
     OUTLET_ON = '1'
     OUTLET_OFF = '0'
 
+    # Time as per time.perf_counter at which the last turn took effect,
+    # to be set by models whose turn methods keep waiting afterwards
+    applied_at = None
+
+    # Whether turn methods wait for the outlets to settle before returning,
+    # models waiting afterwards skip it while turned off
+    settle = True
+
     def __init__(self, logger, outlet_count):
         self.logger = logger
         try:
@@ -62,6 +99,32 @@ class PsGen(metaclass=ABCMeta):
         except ValueError as e:
             raise e('invalid outlet count argument')
 
+    @contextlib.contextmanager
+    def unsettled(self):
+        """
+        Lets turn methods return as soon as the instruction is taken, for
+        callers pacing outlets upon their own deadlines, the outlets being
+        waited for once upon leaving. Should a turn fail, what was owed
+        to the turns sent so far is discarded instead.
+        """
+        previous, self.settle = self.settle, False
+        try:
+            yield self
+        except BaseException:
+            if previous:
+                self.discard_pending()
+            raise
+        finally:
+            self.settle = previous
+        if previous:
+            self.wait_settled()
+
+    def wait_settled(self):
+        """ Wait for the turns sent unsettled to take effect. """
+
+    def discard_pending(self):
+        """ Forget the turns sent unsettled without waiting for them. """
+
     @abstractmethod
     def turn_all_outlets_on(self):
         """ Turn on all outlets. """
@@ -86,6 +149,77 @@ class PsGen(metaclass=ABCMeta):
     def read_outlet(self, outlet_number):
         """ Get status of an outlet by port num """
 
+    def apply_state(self, changes, current):
+        """
+        Turns outlets into the states requested
+
+        Receives the outlets to be changed and the state read of every
+        outlet, both keyed by outlet number with OUTLET_ON or OUTLET_OFF
+        as values. Models with native bulk operations might override it.
+        By default all outlets are turned at once should they all end up
+        in the same state, otherwise one by one.
+        """
+        target = dict(current)
+        target.update(changes)
+        if len(changes) > 1 and len(set(target.values())) == 1:
+            if next(iter(changes.values())) == self.OUTLET_ON:
+                self.turn_all_outlets_on()
+            else:
+                self.turn_all_outlets_off()
+            return
+
+        for outlet, state in sorted(changes.items()):
+            if state == self.OUTLET_ON:
+                self.turn_outlet_on(outlet)
+            else:
+                self.turn_outlet_off(outlet)
+
+
+class AsyncPsGen(metaclass=ABCMeta):
+    """
+    Asynchronous power switch controller base class.
+
+    Counterpart of PsGen whose methods are coroutines, so one event loop
+    can drive many power switches at once.
+    """
+
+    OUTLET_ON = '1'
+    OUTLET_OFF = '0'
+
+    def __init__(self, logger, outlet_count):
+        self.logger = logger
+        self.outlet_count = int(outlet_count)
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    @abstractmethod
+    async def turn_all_outlets_on(self):
+        """ Turn on all outlets. """
+
+    @abstractmethod
+    async def turn_all_outlets_off(self):
+        """ Turn off all outlets. """
+
+    @abstractmethod
+    async def turn_outlet_on(self, outlet_number):
+        """ Turn on a specific outlet by port num. """
+
+    @abstractmethod
+    async def turn_outlet_off(self, outlet_number):
+        """ Turn off a specific outlet by port num. """
+
+    @abstractmethod
+    async def read_all_outlets(self):
+        """ Get status of all outlets """
+
+    @abstractmethod
+    async def read_outlet(self, outlet_number):
+        """ Get status of an outlet by port num """
+
+    async def close(self):
+        """ Release device resources of connection """
+
 
 class PsOutletError(CtrlError):
     def __init__(self, message = None, outlet = None):
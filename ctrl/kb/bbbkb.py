@@ -1,15 +1,109 @@
-from ctrl.gen import KbGen
+from ctrl.gen import KbGen, AsyncKbGen
 from ctrl.gen import KbHwError
 from ctrl.gen import KbSeqError, KbKeyError
-from multiprocessing import Process
+from ctrl.seqc import SeqCompiler, tokenize_seq
+from ctrl.sched import DeadlineScheduler
+from ctrl.aio import write_fd
+from ctrl.trace import KbTrace
+from ctrl.seqc import IR_TEXT, IR_KEY, IR_MOD, IR_PACE, IR_WAIT
 from time import sleep
 
 import struct
 import time
 import logging
+import asyncio
 import os
+import queue
+import sys
+import threading
 
 impt_class='BBBKb'
+impt_aio_class='AsyncBBBKb'
+
+
+class HidWriter(object):
+    '''
+    Long lived writer upon an emulated HID usb port.
+
+    A worker thread holds the port open in binary mode and drains the
+    reports fed through its queue. Whoever submits reports acts as the
+    watchdog of such worker: should a write hang beyond the timeout, the
+    worker is abandoned and a fresh one takes its place for the next
+    submission.
+    '''
+
+    __REOPEN_TIME = 1
+
+    def __init__(self, logger, port, timeout):
+        self.logger = logger
+        self.__port = port
+        self.__timeout = timeout
+        self.__queue = None
+        self.__worker = None
+
+    def start(self):
+        '''Spawns the worker unless a healthy one is already running'''
+        if self.__worker and self.__worker.is_alive():
+            return
+        self.__queue = queue.Queue()
+        self.__worker = threading.Thread(
+            target=self.__drain, args=(self.__queue,),
+            name="hid-writer {0}".format(self.__port), daemon=True)
+        self.__worker.start()
+
+    def stop(self):
+        '''Asks the worker to close the port and quit'''
+        if not self.__worker:
+            return
+        self.__queue.put(None)
+        self.__worker.join(self.__timeout)
+        self.__worker = None
+        self.__queue = None
+
+    def submit(self, *reports):
+        '''
+        Writes the reports in order and waits for the worker to finish.
+
+        Args:
+            reports: bytes-like objects of a report length each one.
+        '''
+        self.start()
+        job = {'reports': reports, 'done': threading.Event(), 'dropped': False}
+        self.__queue.put(job)
+        if not job['done'].wait(self.__timeout):
+            job['dropped'] = True
+            # The hung worker can not be killed, so it is left behind
+            # being told to quit as soon as it gets unblocked
+            self.__queue.put(None)
+            self.__worker = None
+            self.__queue = None
+            raise KbHwError("Keyboard emulator couldn't connect to host or it froze")
+
+    def __drain(self, q):
+        fd = None
+        try:
+            while True:
+                job = q.get()
+                if job is None:
+                    return
+                for report in job['reports']:
+                    while not job['dropped']:
+                        try:
+                            if fd is None:
+                                fd = os.open(self.__port, os.O_WRONLY)
+                            os.write(fd, report)
+                            break
+                        except OSError as e:
+                            self.logger.debug(e)
+                            if fd is not None:
+                                os.close(fd)
+                                fd = None
+                            sleep(self.__REOPEN_TIME)
+                job['done'].set()
+        finally:
+            if fd is not None:
+                os.close(fd)
+
 
 class BBBKb(KbGen):
     '''
@@ -18,6 +112,10 @@ class BBBKb(KbGen):
     '''
 
     __DEFAULT_PORT = "/dev/hidg0"
+    __DEFAULT_HID_TIMEOUT = 20
+
+    # Report sent to stop any keys being pressed
+    __EMPTY_REPORT = bytes(8)
 
     # HID keyboard hex codes for modifier keys
     __MODIFIER_CODES = {
@@ -70,27 +168,49 @@ class BBBKb(KbGen):
     __KEYS_WITH_SHIFT = ['!', '@', '#', '$', '%', '^', '&', '*', '(', ')', '_',
                        '+', '{', '}', '|', ':', '"', '~', '<', '>', '?']
 
+    # Every key translated once and for all into its (usage code, modifier)
+    # pair, letters only need SHIFT modifier when uppercase
+    __KEY_TABLE = {}
+    for k, code in __KEY_CODES.items():
+        __KEY_TABLE[k] = (
+            code, __MODIFIER_CODES["SHIFT_L"] if k in __KEYS_WITH_SHIFT else 0)
+    for code in range(26):
+        __KEY_TABLE[chr(ord('a') + code)] = (0x04 + code, 0)
+        __KEY_TABLE[chr(ord('A') + code)] = (
+            0x04 + code, __MODIFIER_CODES["SHIFT_L"])
+    del k, code
+    __KEY_NAMES = frozenset(__KEY_TABLE)
+
 
     def __init__(self, logger, *args, **kwargs):
         super().__init__(logger)
         self.emulator = kwargs.get('pem_port', self.__DEFAULT_PORT) # Initialize path to HID keyboard emulator
-        self.filepath = "" # Initialize filepath for send_keystrokes_from_file()
-        self.delays = 0 # Delay (seconds) between keystrokes
-        self.modifier = 0 # On default don't use modifier key
-        self.line_number = 0 # Line number we are parsing from filepath
+        self.__compile = SeqCompiler(logger, kwargs.get('seq_cache_dir'))
+        self.__programs = {} # Lowered sequences by digest of their source
+        # Pack bursts of keys in 6-key rollover reports, some hosts can
+        # not cope with it hence it is turned off by default
+        self.__pack_keys = kwargs.get('kb_pack_keys', '0') == '1'
+        self.pacing = DeadlineScheduler() # Paces keystrokes upon deadlines
+        self.trace = KbTrace(kwargs.get('kb_trace_size')) # Latencies recorded
+        self.__writer = HidWriter(
+            logger, self.emulator,
+            float(kwargs.get('hid_timeout', self.__DEFAULT_HID_TIMEOUT))
+        )
 
     def open(self):
-        pass
+        self.__writer.start()
 
     def release(self):
-        pass
+        self.__writer.stop()
 
     def perform(self, filepath):
         '''
         Send keystrokes from a file to USB.
 
         Args:
-            filepath: Path to the text file that contains keystrokes to send.
+            filepath: Path to the text file that contains keystrokes to send,
+                      '-' for stdin or else any file-like object to be typed
+                      as it is read, such as a pipe or a socket made file.
 
         The text file needs to have special syntax. Example:
 
@@ -117,137 +237,161 @@ class BBBKb(KbGen):
 
         '''
 
-        self.delays = 0
-        self.modifier = 0
-        self.filepath = filepath
+        started = time.perf_counter()
+        program = self.compile(filepath)
+        self.trace.start()
+        self.trace.record(KbTrace.TRANSLATE, started)
+        self.__run(program)
 
-        with open(filepath, "r") as f:
-            self.line_number = 1
-            for line in f:
-                line = line.strip()
-                if line:
-                    self.__parse_line(line)
-                self.line_number += 1
-
-
-    def __parse_line(self, line):
+    def compile(self, filepath):
         '''
-        Parse a text file line.
+        Compile a sequence into the reports to be sent.
 
         Args:
-            line: Line from a text file.
-        '''
-        # If line starts with 'DELAY' set the delay
-        if line[0:5] == "DELAY":
-            try:
-                self.delays = float(line.split('=')[1].strip())
-            except ValueError:
-                raise KbSeqError(
-                        "Error in file " + os.path.abspath(self.filepath) +
-                        " on line " + str(self.line_number) + ": " +
-                        "'" + line[6:].strip() + "' not a number")
-        else:
-            # Parse lines keys one at a time
-            i = 0
-            while i < len(line):
-                key = line[i]
-
-                # If key is "<" parse special key
-                if key == "<":
-                    i = self.__parse_special(line, i)
-
-                # If key is " start parsing text
-                elif key == "\"":
-                    i = self.__parse_text(line, i)
+            filepath: As per perform.
 
-                # If key is '#' ignore rest of the line
-                elif key == "#":
-                    return 0
+        Returns:
+            An iterable of (report, delay) pairs, where report is None for
+            waits and delay is the time to keep after sending the report.
+            Streams are lowered lazily as they are read.
+        '''
+        if filepath == '-' or hasattr(filepath, 'read'):
+            # Streams get typed as they are read, rather than compiled
+            source = sys.stdin if filepath == '-' else filepath
+            seq_name = getattr(source, 'name', '<stream>')
+            return self.__lower(
+                tokenize_seq(source, seq_name, self.__MODIFIER_CODES.keys(),
+                    self.__KEY_NAMES),
+                seq_name)
 
-                # If key is ' ', just ignore it
-                elif key == " ":
-                    pass
+        try:
+            digest, ir = self.__compile(filepath, 'seq',
+                self.__MODIFIER_CODES.keys(), self.__KEY_NAMES)
+        except OSError as e:
+            self.logger.error(e)
+            raise KbSeqError("sequence file can not be loaded")
 
-                # If key is anything else raise error
-                else:
-                    raise KbSeqError(
-                            "Error in file " + os.path.abspath(self.filepath) + 
-                            " on line " + str(self.line_number) + ": " +
-                            "Found '" + key + "' outside of <> and \"\"")
-                i += 1
+        if digest not in self.__programs:
+            self.__programs[digest] = list(self.__lower(ir, filepath))
+        return self.__programs[digest]
 
-    def __parse_special(self, line, i):
+    def __run(self, program):
         '''
-        Parse a special key that starts with '<' and ends with '>'.
+        Send the reports of a lowered sequence, paced as per their delays.
+        '''
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        steps = iter(program)
+        self.pacing.start()
+        while True:
+            # Streamed programs get translated as they are iterated
+            started = time.perf_counter()
+            try:
+                report, delay = next(steps)
+            except StopIteration:
+                break
+            self.trace.record(KbTrace.TRANSLATE, started)
+
+            if report is not None:
+                started = time.perf_counter()
+                self.__send_report(report)
+                self.trace.write(started)
+                if debug:
+                    self.logger.debug("Sent report: %s", report.hex())
+            self.pacing.wait(delay)
+        self.logger.debug("pacing jitter: {0}".format(self.pacing.jitter()))
+
+    def __lower(self, ir, filepath):
+        '''
+        Lower a compiled sequence into the reports to be sent.
 
         Args:
-            line: Line from a text file that contains a special key.
-            i: Iterator for the line that tells where the special key starts.
+            ir: Sequence compiled by SeqCompiler, or operations streamed.
+            filepath: Path of the sequence, for error reporting only.
 
-        Returns:
-            i: Iterator for the line that tells where the special key ends.
-        '''
+        Every text is translated in one pass through the key table.
 
-        i += 1
-        special = ""
-        try:
-            # Add letters to 'special' until '>' is found
-            while line[i] != ">":
-                special += line[i]
-                i += 1
-        except IndexError:
-            raise KbSeqError(
-                "Error in file " + os.path.abspath(self.filepath) +
-                " on line " + str(self.line_number) + ": " +
-                "Didn't find closing '>'")
-
-        # If the special key is a modifier, toggle it
-        if special in self.__MODIFIER_CODES:
-            if self.__MODIFIER_CODES[special] == self.modifier:
-                self.modifier = 0
-            else:
-                self.modifier = self.__MODIFIER_CODES[special]
-
-        # If special key is a normal key, send it
+        Yields:
+            (report, delay) pairs, where report is None for waits and delay
+            is the time to keep after sending the report.
+        '''
+        if self.__pack_keys:
+            yield from self.__pack(self.__translate(ir, filepath))
         else:
-            self.__send_a_key(special)
-            sleep(self.delays)
+            yield from self.__translate(ir, filepath)
 
-        return i
+    def __translate(self, ir, filepath):
+        '''
+        Translate every key of a compiled sequence into its own report.
+        '''
+        delays = 0 # Delay (seconds) between keystrokes
+        modifier = 0 # On default don't use modifier key
+
+        for op, arg in ir:
+            if op == IR_TEXT:
+                try:
+                    keys = [self.__KEY_TABLE[k] for k in arg]
+                except KeyError as e:
+                    raise KbSeqError(
+                        "Error in file {0}: Couldn't translate key: '{1}'".format(
+                            filepath, e.args[0]))
+                for hex_key, _modifier in keys:
+                    yield (self.__key_report(hex_key, _modifier or modifier),
+                        delays)
+            elif op == IR_KEY:
+                try:
+                    hex_key, _modifier = self.__KEY_TABLE[arg]
+                except KeyError:
+                    raise KbSeqError(
+                        "Error in file {0}: Couldn't translate key: <{1}>".format(
+                            filepath, arg))
+                yield (self.__key_report(hex_key, _modifier or modifier),
+                    delays)
+            elif op == IR_MOD:
+                # Modifiers are toggled by naming them again
+                if self.__MODIFIER_CODES[arg] == modifier:
+                    modifier = 0
+                else:
+                    modifier = self.__MODIFIER_CODES[arg]
+            elif op == IR_PACE:
+                delays = arg
+            elif op == IR_WAIT:
+                yield (None, arg)
 
-    def __parse_text(self, line, i):
+    def __pack(self, program):
         '''
-        Parse text that starts and ends with ".
+        Pack runs of keys sent with no delay in between into reports using
+        the six key slots, so the host gets them pressed at once in slot
+        order.
+
+        Keys only share a report when they share the modifier and there is
+        a free slot. A key already held in a report is never packed again,
+        it rather starts a new report.
 
         Args:
-            line: Line from a text file that contains "".
-            i: Iterator for the line that tells where the starting " is.
+            program: (report, delay) pairs holding one key each.
 
-        Returns:
-            i: Iterator for the line that tells where the ending " is.
+        Yields:
+            (report, delay) pairs holding up to six keys each.
         '''
-        i += 1
-        try:
-            # Send keys until " is found.
-            while line[i] != "\"":
-                key = line[i]
-                # Allow sending ", by using '\'
-                if key == "\\":
-                    i += 1
-                    key = line[i]
-
-                self.__send_a_key(key)
-                sleep(self.delays)
-                i += 1
-
-        except IndexError:
-            raise KbSeqError(
-                "Error in file " + os.path.abspath(self.filepath) +
-                " on line " + str(self.line_number) + ": " +
-                "Didn't find closing \"")
-        return i
-
-    def __send_a_key(self, key, timeout=20):
+        last = None
+        for report, delay in program:
+            if last is not None and report is not None:
+                last_report, last_delay = last
+                if (last_report is not None and not last_delay
+                        and last_report[0] == report[0]
+                        and 0 in last_report[2:]
+                        and report[2] not in last_report[2:]):
+                    slots = bytearray(last_report)
+                    slots[slots.index(0, 2)] = report[2]
+                    last = (bytes(slots), delay)
+                    continue
+            if last is not None:
+                yield last
+            last = (report, delay)
+        if last is not None:
+            yield last
+
+    def __key_report(self, hex_key, modifier):
         '''
         HID keyboard message length is 8 bytes and format is:
 
@@ -255,91 +399,135 @@ class BBBKb(KbGen):
 
         So first byte is for modifier key and all bytes after third one are for
         normal keys. After sending a key stroke, empty message with zeroes has
-        to be sent to stop the key being pressed. Messages are sent by writing
-        to the emulated HID usb port in /dev/. US HID keyboard hex codes
+        to be sent to stop the key being pressed. US HID keyboard hex codes
         are used for translating keys.
 
         Args:
-            key: A key to send, for example: "a", "z", "3", "F2", "ENTER"
-            timeout: how long sending a key will be tried until quitting [s]
+            hex_key: Usage code of the key, as per the key table
+            modifier: Modifier the key is sent along with
         '''
-        def writer(path, message, empty):
-            while True:
-                try:
-                    with open(path, "w") as emulator:
-                        emulator.write(message.decode()) # Send the key
-                        emulator.write(empty) # Stop the key being pressed
-                except IOError:
-                    sleep(1)
-                else:
-                    return 0
+        return bytes((modifier, 0, hex_key, 0, 0, 0, 0, 0))
 
-        def key_to_hex(k):
-            '''
-            Returns the given keys (US) HID keyboard hex code and possible modifier
-            key.
+    def __send_report(self, report):
+        '''
+        Messages are sent by writing to the emulated HID usb port in /dev/,
+        the report is followed by the empty one.
 
-            Args:
-                k: A key to translate for example: "a", "z", "3", "F2", "ENTER"
-            '''
-            modifier_key = 0 # Initialize modifier_key as 0
+        Args:
+            report: 8 bytes long report of the key to send
+        '''
+        # The writer thread might hang in some rare cases
+        try:
+            self.__writer.submit(report, self.__EMPTY_REPORT)
+        except KbHwError as e:
+            self.logger.error(e)
+            raise
 
-            # Check if the key is in __KEY_CODES
-            if k in list(self.__KEY_CODES.keys()):
-                hex_key = self.__KEY_CODES[k]
 
-                # Check if the key needs SHIFT modifier
-                if k in self.__KEYS_WITH_SHIFT:
-                    modifier_key = self.__MODIFIER_CODES["SHIFT_L"]
+class AsyncBBBKb(AsyncKbGen):
+    '''
+    Asynchronous counterpart of BBBKb.
 
-            # If the key isn't in __KEY_CODES, it should be a normal letter
-            elif len(k) == 1:
-                if 'A' <= k and k <= 'Z':
-                    hex_key = ord(k) - ord('A') + 0x04
-                    # Uppercase letters need SHIFT modifier
-                    modifier_key = self.__MODIFIER_CODES["SHIFT_L"]
+    Reports are written into the emulated HID usb port opened in
+    non-blocking mode, whose writability is awaited through the event loop
+    instead of a writer thread. Sequences are compiled by BBBKb itself.
+    '''
 
-                elif 'a' <= k and k <= 'z':
-                    hex_key = ord(k) - ord('a') + 0x04
+    __DEFAULT_HID_TIMEOUT = 20
+    __REOPEN_TIME = 1
 
-                else:
-                    raise KbSeqError(
-                        "Error in file " + os.path.abspath(self.filepath) +
-                        " on line " + str(self.line_number) + ": " +
-                        "Couldn't translate key: '" + k +"'")
-            else:
-                raise KbSeqError(
-                    "Error in file " + os.path.abspath(self.filepath) +
-                    " on line " + str(self.line_number) + ": " +
-                     "Couldn't translate key: <" + k + ">")
-            return hex_key, modifier_key
-
-
-        # Empty message which will be sent to stop any keys being pressed
-        empty = "\x00\x00\x00\x00\x00\x00\x00\x00"
-        usb_message = bytearray(empty.encode()) # Initialize usb message
-        hex_key, _modifier = key_to_hex(key) # Translate key to hex code
-
-        # Override self.modifier if the key needs a specific one
-        if _modifier:
-            modifier = _modifier
-        else:
-            modifier = self.modifier
+    # Report sent to stop any keys being pressed
+    __EMPTY_REPORT = bytes(8)
 
-        usb_message[2] = hex_key
-        usb_message[0] = modifier
+    def __init__(self, logger, *args, **kwargs):
+        super().__init__(logger)
+        self.__kb = BBBKb(logger, *args, **kwargs)
+        self.emulator = self.__kb.emulator
+        self.__timeout = float(
+            kwargs.get('hid_timeout', self.__DEFAULT_HID_TIMEOUT))
+        self.__fd = None
+        self.pacing = DeadlineScheduler() # Paces keystrokes upon deadlines
+        self.trace = KbTrace(kwargs.get('kb_trace_size')) # Latencies recorded
+
+    async def open(self):
+        if self.__fd is not None:
+            return
+        try:
+            self.__fd = os.open(self.emulator, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            self.logger.error(e)
+            raise KbHwError("Keyboard emulator port can not be opened")
+
+    async def release(self):
+        self.__close()
+
+    async def perform(self, filepath):
+        '''
+        Send keystrokes from a file to USB.
+
+        Args:
+            filepath: Path to the text file that contains keystrokes to send,
+                      as per BBBKb.perform. Streams are not supported since
+                      reading them would block the event loop.
+        '''
+        if filepath == '-' or hasattr(filepath, 'read'):
+            raise KbSeqError("streams can not be performed asynchronously")
 
-        # Do the writing in a subprocess as it hangs in some rare cases
-        writer = Process(target=writer, args=(self.emulator, usb_message, empty))
-        writer.start()
-        writer.join(20)
-        if writer.is_alive():
-            writer.terminate()
+        started = time.perf_counter()
+        program = self.__kb.compile(filepath)
+        self.trace.start()
+        self.trace.record(KbTrace.TRANSLATE, started)
+        await self.open()
+
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        self.pacing.start()
+        try:
+            for report, delay in program:
+                if report is not None:
+                    started = time.perf_counter()
+                    await self.__send_report(report)
+                    self.trace.write(started)
+                    if debug:
+                        self.logger.debug("Sent report: %s", report.hex())
+                await self.pacing.wait_async(delay)
+        except asyncio.CancelledError:
+            # Leave no key being pressed upon the host
+            try:
+                os.write(self.__fd, self.__EMPTY_REPORT)
+            except (OSError, TypeError):
+                pass
+            raise
+        self.logger.debug("pacing jitter: {0}".format(self.pacing.jitter()))
+
+    async def __send_report(self, report):
+        '''
+        Write a report followed by the empty one, the writing might hang
+        in some rare cases hence it is watched over by a timeout.
+        '''
+        try:
+            await asyncio.wait_for(
+                self.__write(report, self.__EMPTY_REPORT), self.__timeout)
+        except asyncio.TimeoutError:
             msg = "Keyboard emulator couldn't connect to host or it froze"
-            self.logger.error(msg, "kb_emulator.log")
+            self.logger.error(msg)
             raise KbHwError(msg)
 
-        self.logger.info("Sent key: " + key.ljust(5) + "  hex code: " +
-                    format(hex_key, '#04x') + "  modifier: " +
-                    format(modifier, '#04x'), "kb_emulator.log")
-        return 0
+    async def __write(self, *reports):
+        '''Write reports in order, reopening the port upon errors'''
+        for report in reports:
+            while True:
+                try:
+                    if self.__fd is None:
+                        self.__fd = os.open(
+                            self.emulator, os.O_WRONLY | os.O_NONBLOCK)
+                    await write_fd(self.__fd, report)
+                    break
+                except OSError as e:
+                    self.logger.debug(e)
+                    self.__close()
+                    await asyncio.sleep(self.__REOPEN_TIME)
+
+    def __close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
@@ -0,0 +1,160 @@
+"""
+Simulated keyboard emulator, recording instead of typing
+
+It lets a sequence go through the very same compilation as the hardware
+backend it simulates, then records the HID reports or serial octets that
+backend would emit, stamped with a virtual clock in place of real pacing.
+No hardware is needed and no time is spent waiting, so throughput and
+output can be checked byte for byte by CI in milliseconds.
+
+Capture files start with a header, then hold a record per emission:
+
+    header:  b'MIMICAP' + version octet + flavor name length octet + name
+    record:  virtual time in ns (u64 LE) + payload length (u16 LE) + payload
+"""
+from ctrl.gen import KbGen
+from ctrl.gen import KbHwError
+from ctrl.registry import registry
+
+import struct
+import time
+
+impt_class='SimKb'
+
+CAPTURE_MAGIC = b'MIMICAP'
+CAPTURE_VERSION = 1
+_RECORD = struct.Struct('<QH')
+
+
+def read_capture(capture_file):
+    """
+    Reads a capture file
+
+    Returns the flavor it was recorded as, along with the list of its
+    (virtual time in seconds, payload) records.
+    """
+    with open(capture_file, 'rb') as cf:
+        data = cf.read()
+
+    if data[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+        raise KbHwError("{0} is not a capture file".format(capture_file))
+    pos = len(CAPTURE_MAGIC) + 1
+    flavor = data[pos + 1:pos + 1 + data[pos]].decode('ascii')
+    pos += 1 + data[pos]
+
+    records = []
+    while pos < len(data):
+        ns, length = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        records.append((ns / 1e9, data[pos:pos + length]))
+        pos += length
+    return flavor, records
+
+
+class SimKb(KbGen):
+    """
+    Keyboard emulator simulating either the BBBKb or the UsbKm232 backend
+
+    The parameters not meant for the simulation are fed to the backend
+    simulated, so the same sequence options apply. Writes are deemed to
+    take a fixed virtual time: a HID polling interval for reports, or the
+    line time of an octet for serial.
+    """
+
+    __FLAVORS = {
+        'bbbkb': {'write_time': 0.001},
+        'usbkm232': {'write_time': None},
+    }
+    __DEFAULT_FLAVOR = 'bbbkb'
+    __DEFAULT_BAUD_RATE = 9600
+    __BITS_PER_OCTET = 10
+
+    # Report sent to stop any keys being pressed
+    __EMPTY_REPORT = bytes(8)
+
+    def __init__(self, logger, *args, **kwargs):
+        super().__init__(logger)
+
+        self.flavor = kwargs.pop('sim_flavor', self.__DEFAULT_FLAVOR)
+        if self.flavor not in self.__FLAVORS:
+            raise KbHwError("unknown simulation flavor {0}".format(self.flavor))
+        self.__capture_file = kwargs.pop('capture_file', None)
+        write_time = kwargs.pop('sim_write_time', None)
+
+        flavor = self.__FLAVORS[self.flavor]
+        if self.flavor == 'usbkm232':
+            kwargs.setdefault('conn_tty', 'sim')
+        self.__backend = registry.resolve(self.flavor)(logger, *args, **kwargs)
+
+        if write_time is not None:
+            self.__write_time = float(write_time)
+        elif flavor['write_time'] is not None:
+            self.__write_time = flavor['write_time']
+        else:
+            self.__write_time = self.__BITS_PER_OCTET / float(
+                kwargs.get('conn_baud_rate', self.__DEFAULT_BAUD_RATE))
+
+        self.__capture = None
+        self.__clock = 0
+        self.stats = {}
+
+    def open(self):
+        """Starts the virtual clock and the capture file, if any"""
+        self.__clock = 0
+        if self.__capture_file and not self.__capture:
+            name = self.flavor.encode('ascii')
+            self.__capture = open(self.__capture_file, 'wb')
+            self.__capture.write(CAPTURE_MAGIC + bytes(
+                [CAPTURE_VERSION, len(name)]) + name)
+
+    def release(self):
+        if self.__capture:
+            self.__capture.close()
+            self.__capture = None
+
+    def perform(self, seq):
+        """
+        Records what the backend simulated would emit for a sequence
+
+        The virtual clock keeps running across sequences until reopened.
+        Figures of the run are left in stats.
+        """
+        wall_start = time.perf_counter()
+        start = self.__clock
+        deadline = self.__clock
+        write_ns = int(self.__write_time * 1e9)
+        emissions = octets = 0
+
+        for payload, delay in self.__backend.compile(seq):
+            if payload:
+                payloads = [payload]
+                if self.flavor == 'bbbkb':
+                    payloads.append(self.__EMPTY_REPORT)
+                for p in payloads:
+                    self.__record(p)
+                    self.__clock += write_ns * (
+                        len(p) if self.flavor == 'usbkm232' else 1)
+                    emissions += 1
+                    octets += len(p)
+
+            # Pacing as per DeadlineScheduler, upon the virtual clock
+            if delay and delay > 0:
+                deadline += int(delay * 1e9)
+                self.__clock = max(self.__clock, deadline)
+            else:
+                deadline = max(deadline, self.__clock)
+
+        elapsed = (self.__clock - start) / 1e9
+        self.stats = {
+            'emissions': emissions,
+            'octets': octets,
+            'virtual_elapsed': elapsed,
+            'octets_per_second': octets / elapsed if elapsed else 0.0,
+            'wall_elapsed': time.perf_counter() - wall_start,
+        }
+        self.logger.debug("simulation stats: {0}".format(self.stats))
+
+    def __record(self, payload):
+        if self.__capture:
+            self.__capture.write(
+                _RECORD.pack(self.__clock, len(payload)) + payload)
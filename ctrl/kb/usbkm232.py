@@ -1,14 +1,236 @@
-from ctrl.gen import KbGen
+from ctrl.gen import KbGen, AsyncKbGen
 from ctrl.gen import KbHwError
 from ctrl.gen import KbSeqError, KbKeyError
-
+from ctrl.seqc import SeqCompiler
+from ctrl.sched import DeadlineScheduler
+from ctrl.aio import write_fd
+from ctrl.trace import KbTrace
+from ctrl.seqc import IR_TEXT, IR_WAIT
+
+import asyncio
+import bisect
+import collections
+import itertools
+import random
+import threading
 import time
-import json
 import serial
 import logging
 import os
 
 impt_class='UsbKm232'
+impt_aio_class='AsyncUsbKm232'
+
+
+class AckReader(object):
+    """
+    Background checker of the responses of UsbKm232
+
+    The device answers every octet with its complement. Octets written are
+    held as outstanding, up to a sliding window, while a reader thread
+    matches the responses against them. The first mismatch is kept as
+    error along with the position of the octet within the sequence.
+    Should the connection itself fail, its exception is raised again to
+    the writer, as a link failure is worth reconnecting for.
+    """
+
+    def __init__(self, logger, conn, window, timeout, position=0):
+        self.logger = logger
+        self.__conn = conn
+        self.__window = max(1, window)
+        self.__timeout = timeout
+        self.__outstanding = collections.deque()
+        self.__cond = threading.Condition()
+        self.__reader = None
+        self.__running = False
+        self.__position = position
+        self.acked = position   # position of the first octet unanswered
+        self.error = None
+        self.link_error = None
+
+    def start(self):
+        self.__running = True
+        self.__reader = threading.Thread(
+            target=self.__read, name="usbkm232-acks", daemon=True)
+        self.__reader.start()
+
+    def stop(self):
+        self.__running = False
+        if self.__reader:
+            # The reader is woken up rather than left to its read timeout
+            cancel_read = getattr(self.__conn, 'cancel_read', None)
+            if cancel_read:
+                try:
+                    cancel_read()
+                except (serial.SerialException, OSError) as e:
+                    self.logger.debug(e)
+            self.__reader.join()
+            self.__reader = None
+
+    def expect(self, octets):
+        """
+        Holds octets about to be written as outstanding, waiting for the
+        window to make room for all of them
+        """
+        with self.__cond:
+            room = lambda: self.error or (
+                len(self.__outstanding) + len(octets) <= self.__window
+                or not self.__outstanding)
+            if not self.__cond.wait_for(room, self.__timeout):
+                self.__fail("no response from UsbKm232 past octet {0}".format(
+                    self.acked))
+            self.__check()
+            for o in octets:
+                self.__outstanding.append((self.__position, o))
+                self.__position += 1
+
+    def drain(self):
+        """Waits until every octet written gets its response"""
+        with self.__cond:
+            done = lambda: self.error or not self.__outstanding
+            if not self.__cond.wait_for(done, self.__timeout):
+                self.__fail("no response from UsbKm232 past octet {0}".format(
+                    self.acked))
+            self.__check()
+
+    def __check(self):
+        if self.link_error:
+            raise self.link_error
+        if self.error:
+            self.__fail(self.error)
+
+    def __fail(self, msg):
+        self.logger.error(msg)
+        raise KbHwError("Failed to get correct response from UsbKm232: " + msg)
+
+    def __read(self):
+        while self.__running:
+            try:
+                rsp = self.__conn.read(max(1, self.__conn.in_waiting))
+            except (serial.SerialException, OSError) as e:
+                with self.__cond:
+                    self.link_error = serial.SerialException(str(e))
+                    self.error = str(e)
+                    self.__cond.notify_all()
+                return
+            if not rsp:
+                continue
+            with self.__cond:
+                for r in rsp:
+                    if not self.__outstanding:
+                        self.error = "unexpected response 0x{0:02x}".format(r)
+                        break
+                    position, o = self.__outstanding.popleft()
+                    if o != (~r & 0xff):
+                        self.error = (
+                            "octet {0} (0x{1:02x}) got response 0x{2:02x}".format(
+                                position, o, r))
+                        break
+                    self.acked += 1
+                self.__cond.notify_all()
+            if self.error:
+                return
+
+
+class SerialSession(object):
+    """
+    Serial connection to UsbKm232 lasting across sequences
+
+    Connections are attempted with exponential backoff plus jitter, so a
+    device being re-enumerated gets time to come back rather than being
+    hammered at a fixed pace. A cheap probe tells whether the connection
+    still stands before it is reused.
+    """
+
+    def __init__(self, logger, connect, tries, retry_time, retry_max):
+        self.logger = logger
+        self.__connect = connect
+        self.__tries = max(1, tries)
+        self.__retry_time = retry_time
+        self.__retry_max = retry_max
+        self.__opened = False
+        self.conn = None
+        self.reconnects = 0
+
+    def alive(self):
+        """Probes the connection, without any traffic to the device"""
+        if not self.conn or not self.conn.is_open:
+            return False
+        try:
+            self.conn.in_waiting
+        except (serial.SerialException, OSError) as e:
+            self.logger.debug(e)
+            return False
+        return True
+
+    def ensure(self):
+        """Returns the connection, reopened should it not stand anymore"""
+        if not self.alive():
+            self.reopen()
+        return self.conn
+
+    async def ensure_async(self):
+        """Counterpart of ensure backing off upon the event loop"""
+        if not self.alive():
+            await self.reopen_async()
+        return self.conn
+
+    def reopen(self):
+        """
+        Replaces the connection by a new one
+
+        Raises KbHwError once every attempt failed.
+        """
+        self.close()
+        for attempt in range(self.__tries):
+            if self.__attempt():
+                return self.conn
+            if attempt + 1 < self.__tries:
+                time.sleep(self.backoff(attempt))
+        self.__give_up()
+
+    async def reopen_async(self):
+        """Counterpart of reopen backing off upon the event loop"""
+        self.close()
+        for attempt in range(self.__tries):
+            if self.__attempt():
+                return self.conn
+            if attempt + 1 < self.__tries:
+                await asyncio.sleep(self.backoff(attempt))
+        self.__give_up()
+
+    def __attempt(self):
+        try:
+            self.conn = self.__connect()
+        except (serial.SerialException, OSError) as e:
+            self.logger.debug(e)
+            return False
+        if self.__opened:
+            self.reconnects += 1
+            self.logger.warning("serial connection reopened ({0})".format(
+                self.reconnects))
+        self.__opened = True
+        return True
+
+    def __give_up(self):
+        self.logger.error('Too tries to connect target')
+        raise KbHwError("Problems performing serial connection")
+
+    def backoff(self, attempt):
+        """Time to wait after a failed attempt, jittered upon its half"""
+        delay = min(self.__retry_max, self.__retry_time * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def close(self):
+        if self.conn:
+            try:
+                if self.conn.is_open:
+                    self.logger.debug("Closing serial connection")
+                    self.conn.close()
+            except (serial.SerialException, OSError) as e:
+                self.logger.debug(e)
+            self.conn = None
+
 
 class UsbKm232(KbGen):
 
@@ -17,6 +239,7 @@ class UsbKm232(KbGen):
     __DEFAULT_CONN_WTRY_TIMEOUT = 0.5
     __DEFAULT_CONN_TRIES = 5
     __DEFAULT_CONN_RETRY_TIME = 2
+    __DEFAULT_CONN_RETRY_MAX = 30
 
     __US_KEY_TABLE_SIZE = 126
     __EMU_SCANCODES = {
@@ -52,50 +275,180 @@ class UsbKm232(KbGen):
         "{": 141, "}": 142, "+": 143, "|": 144, "\"": 145, "^": 146,
         "&": 147,
     }
+    # Octet releasing every key made, once written
+    BUFFER_CLEAR = bytes([__EMU_SCANCODES['[BUFFER_CLEAR]']])
+
+    # Virtual keys are typed as their base key with left shift made
+    __SHIFTED_BASES = {
+        "+": "=", "_": "-", "|": "\\", "<": ",", ">": ".", "?": "/",
+        ":": ";", "\"": "'", "~": "`", "{": "[", "}": "]", "!": "1",
+        "@": "2", "#": "3", "$": "4", "%": "5", "^": "6", "&": "7",
+        "*": "8", "(": "9", ")": "0",
+    }
+    __SHIFTED_SCANCODES = {}
+    for v, b in __SHIFTED_BASES.items():
+        __SHIFTED_SCANCODES[__EMU_SCANCODES[v]] = __EMU_SCANCODES[b]
+    del v, b
+
+    # Every octet fed to the device ends up as a HID report sent upon the
+    # next interrupt poll of the host, hence a burst is paced upon both
+    # the serial line time and such polling interval
+    __DEFAULT_BURST_CHUNK = 16
+    __DEFAULT_BURST_OCTET_TIME = 0.01
+    __BITS_PER_OCTET = 10
+
+    __DEFAULT_ACK_WINDOW = 16
 
     def __init__(self, logger, *args, **kwargs):
         super().__init__(logger)
 
         self.__conn_config = {
-            'CONN_BAUD_RATE':kwargs.get('conn_baud_rate', self.__DEFAULT_CONN_BAUD_RATE),
-            'CONN_TRY_TIMEOUT':kwargs.get('conn_try_timeout', self.__DEFAULT_CONN_TRY_TIMEOUT),
-            'CONN_WTRY_TIMEOUT':kwargs.get('conn_wtry_timeout', self.__DEFAULT_CONN_WTRY_TIMEOUT),
-            'CONN_TRIES':kwargs.get('conn_tries', self.__DEFAULT_CONN_TRIES),
-            'CONN_RETRY_TIME':kwargs.get('conn_retry_time', self.__DEFAULT_CONN_RETRY_TIME),
+            'CONN_BAUD_RATE':int(kwargs.get('conn_baud_rate', self.__DEFAULT_CONN_BAUD_RATE)),
+            'CONN_TRY_TIMEOUT':float(kwargs.get('conn_try_timeout', self.__DEFAULT_CONN_TRY_TIMEOUT)),
+            'CONN_WTRY_TIMEOUT':float(kwargs.get('conn_wtry_timeout', self.__DEFAULT_CONN_WTRY_TIMEOUT)),
+            'CONN_TRIES':int(kwargs.get('conn_tries', self.__DEFAULT_CONN_TRIES)),
+            'CONN_RETRY_TIME':float(kwargs.get('conn_retry_time', self.__DEFAULT_CONN_RETRY_TIME)),
+            'CONN_RETRY_MAX':float(kwargs.get('conn_retry_max', self.__DEFAULT_CONN_RETRY_MAX)),
         }
 
+        self.__compile = SeqCompiler(logger, kwargs.get('seq_cache_dir'))
+        self.__programs = {} # Lowered sequences by digest of their source
+        self.pacing = DeadlineScheduler() # Paces octets upon deadlines
+        self.trace = KbTrace(kwargs.get('kb_trace_size')) # Latencies recorded
+        self.__debug = False
+        self.stats = {}
+
+        # Responses get checked by a reader thread along a sliding window
+        # of octets written, rather than waiting for each one in turn
+        self.__check_resp = kwargs.get('check_resp', '0') == '1'
+        self.__ack_window = int(kwargs.get('ack_window', self.__DEFAULT_ACK_WINDOW))
+        self.__acks = None
+
+        # Burst mode writes whole instructions as chunks of octets
+        # fitting the device input buffer
+        self.__burst = kwargs.get('burst', '0') == '1'
+        self.__burst_chunk = int(
+            kwargs.get('burst_chunk', self.__DEFAULT_BURST_CHUNK))
+        self.__burst_octet_time = max(
+            float(kwargs.get('burst_octet_time', self.__DEFAULT_BURST_OCTET_TIME)),
+            self.__BITS_PER_OCTET / float(self.__conn_config['CONN_BAUD_RATE']))
+
         try:
             self.__conn_config['CONN_TTY'] = kwargs['conn_tty']
         except (KeyError) as e:
             self.logger.error(e)
             raise KbHwError("conn_tty was not fed as parameter")
 
+        # The connection outlives sequences, being reopened on failure
+        self.session = SerialSession(logger, self.connect,
+            self.__conn_config['CONN_TRIES'],
+            self.__conn_config['CONN_RETRY_TIME'],
+            self.__conn_config['CONN_RETRY_MAX'])
+
 
     def open(self):
+        self.session.ensure()
 
-        def connect_target():
-            for t in range(0, self.__conn_config['CONN_TRIES']):
-                try:
-                    conn = serial.Serial(
-                        self.__conn_config['CONN_TTY'],
-                        write_timeout = self.__conn_config['CONN_WTRY_TIMEOUT'],
-                        timeout = self.__conn_config['CONN_TRY_TIMEOUT'],
-                        baudrate = self.__conn_config['CONN_BAUD_RATE']
-                    )
-                    return conn
-                except serial.SerialException:
-                    time.sleep(self.__conn_config['CONN_RETRY_TIME'])
-            raise serial.SerialException('Too tries to connect target')
+    def connect(self):
+        """Attempts a single serial connection to target"""
+        return serial.Serial(
+            self.__conn_config['CONN_TTY'],
+            write_timeout = self.__conn_config['CONN_WTRY_TIMEOUT'],
+            timeout = self.__conn_config['CONN_TRY_TIMEOUT'],
+            baudrate = self.__conn_config['CONN_BAUD_RATE']
+        )
 
+    def perform(self, seq_file):
 
+        started = time.perf_counter()
+        program = self.compile(seq_file)
+        self.trace.start()
+        self.trace.record(KbTrace.TRANSLATE, started)
+
+        self.__debug = self.logger.isEnabledFor(logging.DEBUG)
+        self.__writes = 0
+        # Octets written before every step, so a run can be resumed
+        # from any octet position
+        offsets = list(itertools.accumulate(
+            [0] + [len(payload) for payload, _ in program]))
+        position = resumes = 0
         try:
-            self.__conn = connect_target()
-        except (serial.SerialException) as e:
+            self.session.ensure()
+            self.pacing.start()
+            run_start = time.perf_counter()
+            while True:
+                try:
+                    self.__run(program, offsets, position)
+                    break
+                except (serial.SerialException, OSError) as e:
+                    self.logger.error(e)
+                    if resumes >= self.__conn_config['CONN_TRIES']:
+                        raise KbHwError('Experimenting serial connection problems')
+                    resumes += 1
+                    position = self.__resume_at
+                    self.logger.warning(
+                        "resuming sequence from octet {0}".format(position))
+                    self.session.reopen()
+            elapsed = time.perf_counter() - run_start
+            self.stats = {
+                'octets': offsets[-1],
+                'writes': self.__writes,
+                'elapsed': elapsed,
+                'octets_per_second': offsets[-1] / elapsed if elapsed else 0.0,
+                'jitter': self.pacing.jitter(),
+                'resumes': resumes,
+                'reconnects': self.session.reconnects,
+            }
+            self.logger.debug("sequence stats: {0}".format(self.stats))
+        except (serial.SerialException, OSError) as e:
             self.logger.error(e)
-            raise KbHwError("Problems performing serial connection")
-
-    def perform(self, seq_file):
-
+            raise KbHwError('Experimenting serial connection problems')
+
+    def __run(self, program, offsets, position):
+        """
+        Writes a program from an octet position onwards
+
+        Upon a connection failure the position to resume from is left in
+        __resume_at: the first octet unanswered when responses are being
+        checked, otherwise the first octet of the write that failed.
+        """
+        step = bisect.bisect_right(offsets, position) - 1
+        skip = position - offsets[step]
+        self.__resume_at = position
+        if self.__check_resp:
+            self.__acks = AckReader(self.logger, self.session.conn,
+                self.__ack_window, self.__conn_config['CONN_TRY_TIMEOUT'],
+                position)
+            self.__acks.start()
+        try:
+            for i in range(step, len(program)):
+                payload, time_gap = program[i]
+                if payload:
+                    self.__resume_at = offsets[i] + skip
+                    started = time.perf_counter()
+                    self.__send_octet(payload[skip:] if skip else payload)
+                    self.trace.write(started)
+                    self.__writes += 1
+                    skip = 0
+                self.pacing.wait(time_gap)
+            if self.__acks:
+                self.__acks.drain()
+        except (serial.SerialException, OSError):
+            if self.__acks:
+                self.__resume_at = self.__acks.acked
+            raise
+        finally:
+            if self.__acks:
+                self.__acks.stop()
+                self.__acks = None
+
+    def compile(self, seq_file):
+        """
+        Compiles a sequence file into the octets to be written
+
+        Returns a list of (octet, time gap) pairs where the octet is
+        empty for those waits in between instructions.
+        """
         if not seq_file:
             self.logger.fatal('A sequence file was not fed')
             raise KbHwError("sequence file can not be loaded")
@@ -106,140 +459,166 @@ class UsbKm232(KbGen):
             raise KbHwError("sequence file can not be loaded")
 
         try:
-            with open(seq_file) as sf:
-                json_lines = sf.read()
-                parsed_json = json.loads(json_lines)
-                self.__plan = parsed_json['ktasks']
-        except (KeyError, OSError, IOError) as e:
+            digest, ir = self.__compile(seq_file, 'ktasks')
+        except OSError as e:
             self.logger.error(e)
             self.logger.fatal("malformed sequence file in: {0}".format(
-                plan_file))
+                seq_file))
             raise KbHwError("sequence file can not be loaded")
 
-        def exec_inst(inst, time_gap):
-
-            # The scancode for key release (break) is obtained
-            # from the scancode for key press (make)
-            # by setting the high order bit
-            RELEASE_KEY_MASK = 0x80
-            release_sc = lambda sc: '%c' % (sc | RELEASE_KEY_MASK)
-
-            if inst in self.__EMU_SCANCODES:
-                sc = self.__EMU_SCANCODES[inst]
-                if sc > self.__US_KEY_TABLE_SIZE:
-                    self.__cover_virtual(sc)
-                    return
-                # clr_buff flag set on True ensures that all
-                # made keys currently in USB buffer are released
-                self.__send_octet(chr(sc), clr_buff=False)
-                self.__send_octet(release_sc(sc))
-            else:
-                for ch in inst:
-                    sc = self.__EMU_SCANCODES['%s' % ch]
-                    if sc > self.__US_KEY_TABLE_SIZE:
-                        self.__cover_virtual(sc)
-                        continue
-                    self.__send_octet(chr(sc), clr_buff=False)
-                    self.__send_octet(release_sc(sc))
-            self.logger.debug("Waiting {0} seconds to send next instruction".format(time_gap))
-            time.sleep(time_gap)
-
-        for task in self.__plan:
-            try:
-                desc = task['_desc']
-                counter = int(task.get('_times', '1'))
-                time_gap = int(task.get('_time_gap', '1'))
-                inst = task['_inst']
-
-                while counter > 0:
-                    self.logger.debug("Sending {0} instruction : {1}".format(desc, inst))
-                    exec_inst(inst, time_gap)
-                    counter = counter - 1
-            except KeyError:
-                self.logger.fatal('One or more tasks upon sequence are badly conformed')
-                raise KbSeqError('sequence badly conformed')
-            except KbKeyError:
-                raise
-            except KbHwError:
-                raise
-            except (serial.SerialException) as e:
-                self.logger.error(e)
-                raise KbHwError('Experimenting serial connection problems')
-
-    def release(self):
-
-        if self.__conn and self.__conn.isOpen():
-            self.logger.debug("Closing serial connection")
-            self.__conn.close()
-
+        if digest not in self.__programs:
+            self.__programs[digest] = self.__lower(ir)
+        return self.__programs[digest]
 
-    def __send_octet(self, octet, check_resp=False, clr_buff=True):
-
-        MAX_RSP_RETRIES = 10
+    def __lower(self, ir):
+        """
+        Lowers a compiled sequence into the octets to be written
+        """
         SILENCE_TIME = 0.09
 
-        clear_sc = lambda: '%c' % self.__EMU_SCANCODES['[BUFFER_CLEAR]']
+        # The scancode for key release (break) is obtained
+        # from the scancode for key press (make)
+        # by setting the high order bit
+        RELEASE_KEY_MASK = 0x80
+        clear_sc = self.__EMU_SCANCODES['[BUFFER_CLEAR]']
 
-        def check(orig_octet):
-            count = 0
-            rsp = self.__conn.read(1)
-            self.logger.debug("re-read rsp = " + str(rsp))
-            while (len(rsp) != 1 or ord(orig_octet) != (~ord(rsp) & 0xff)) and count < MAX_RSP_RETRIES:
-                rsp = self.__conn.read(1)
-                self.logger.debug("re-read rsp = " + str(rsp))
-                time.sleep(1)
-                count += 1
-            if count == MAX_RSP_RETRIES:
-                raise KbHwError("Failed to get correct response from UsbKm232")
+        def lower_sc(sc):
+            if sc > self.__US_KEY_TABLE_SIZE:
+                make, brk = self.__cover_virtual(sc)
+            else:
+                make, brk = sc, sc | RELEASE_KEY_MASK
+            # Clearing the buffer after the break ensures that all
+            # made keys currently in USB buffer are released
+            return [
+                (bytes([make]), SILENCE_TIME),
+                (bytes([brk]), SILENCE_TIME),
+                (bytes([clear_sc]), 0),
+            ]
+
+        program = []
+        for op, arg in ir:
+            if op == IR_TEXT:
+                octets = []
+                if arg in self.__EMU_SCANCODES:
+                    octets.extend(lower_sc(self.__EMU_SCANCODES[arg]))
+                else:
+                    for ch in arg:
+                        try:
+                            sc = self.__EMU_SCANCODES[ch]
+                        except KeyError:
+                            self.logger.fatal(
+                                'One or more tasks upon sequence are badly conformed')
+                            raise KbSeqError('sequence badly conformed')
+                        octets.extend(lower_sc(sc))
+
+                if not self.__burst:
+                    program.extend(octets)
+                    continue
+
+                buff = b''.join(o for o, _ in octets)
+                for i in range(0, len(buff), self.__burst_chunk):
+                    chunk = buff[i:i + self.__burst_chunk]
+                    program.append(
+                        (chunk, len(chunk) * self.__burst_octet_time))
+            elif op == IR_WAIT:
+                program.append((b'', arg))
+        return program
 
-        try:
-            self.logger.debug("Writing \\0%03o 0x%02x" % (ord(octet), ord(octet)))
-            self.__conn.write(bytes(octet, 'UTF-8'))
+    def release(self):
+        self.session.close()
 
-            if check_resp:
-                check(octet)
 
-            time.sleep(SILENCE_TIME)
+    def __send_octet(self, octet):
 
-            if clr_buff:
-                self.logger.debug("Clearing keystrokes")
-                self.__conn.write(bytes(clear_sc(), 'UTF-8'))
-                if check_resp:
-                    check(clear_sc())
+        try:
+            if self.__debug:
+                for o in octet:
+                    self.logger.debug("Writing \\0%03o 0x%02x" % (o, o))
+            if self.__acks:
+                self.__acks.expect(octet)
+            self.session.conn.write(octet)
         except (serial.SerialException, KbHwError) as e:
             raise
 
     def __cover_virtual(self, sc):
+        """
+        Virtual keys are typed as their base key with left shift made
 
-        def l_shift(break_code):
-            self.__send_octet(chr(self.__EMU_SCANCODES['<lshift>']), clr_buff=False)
-            self.__send_octet(chr(break_code))
-
-        cases = {
-            self.__EMU_SCANCODES['+'] : lambda: l_shift(self.__EMU_SCANCODES['=']),
-            self.__EMU_SCANCODES['_'] : lambda: l_shift(self.__EMU_SCANCODES['-']),
-            self.__EMU_SCANCODES['|'] : lambda: l_shift(self.__EMU_SCANCODES['\\']),
-            self.__EMU_SCANCODES['<'] : lambda: l_shift(self.__EMU_SCANCODES[',']),
-            self.__EMU_SCANCODES['>'] : lambda: l_shift(self.__EMU_SCANCODES['.']),
-            self.__EMU_SCANCODES['?'] : lambda: l_shift(self.__EMU_SCANCODES['/']),
-            self.__EMU_SCANCODES[':'] : lambda: l_shift(self.__EMU_SCANCODES[';']),
-            self.__EMU_SCANCODES['"'] : lambda: l_shift(self.__EMU_SCANCODES['\'']),
-            self.__EMU_SCANCODES['~'] : lambda: l_shift(self.__EMU_SCANCODES['`']),
-            self.__EMU_SCANCODES['{'] : lambda: l_shift(self.__EMU_SCANCODES['[']),
-            self.__EMU_SCANCODES['}'] : lambda: l_shift(self.__EMU_SCANCODES[']']),
-            self.__EMU_SCANCODES['!'] : lambda: l_shift(self.__EMU_SCANCODES['1']),
-            self.__EMU_SCANCODES['@'] : lambda: l_shift(self.__EMU_SCANCODES['2']),
-            self.__EMU_SCANCODES['#'] : lambda: l_shift(self.__EMU_SCANCODES['3']),
-            self.__EMU_SCANCODES['$'] : lambda: l_shift(self.__EMU_SCANCODES['4']),
-            self.__EMU_SCANCODES['%'] : lambda: l_shift(self.__EMU_SCANCODES['5']),
-            self.__EMU_SCANCODES['^'] : lambda: l_shift(self.__EMU_SCANCODES['6']),
-            self.__EMU_SCANCODES['&'] : lambda: l_shift(self.__EMU_SCANCODES['7']),
-            self.__EMU_SCANCODES['*'] : lambda: l_shift(self.__EMU_SCANCODES['8']),
-            self.__EMU_SCANCODES['('] : lambda: l_shift(self.__EMU_SCANCODES['9']),
-            self.__EMU_SCANCODES[')'] : lambda: l_shift(self.__EMU_SCANCODES['0']),
-        }
-
+        Returns the make octet of left shift and that of the base key,
+        the latter is released as the buffer gets cleared afterwards.
+        """
         try:
-            cases[sc]()
+            return self.__EMU_SCANCODES['<lshift>'], self.__SHIFTED_SCANCODES[sc]
         except KeyError:
             raise KbKeyError("Emulation for {0} key is not supported".format(sc))
+
+
+class AsyncUsbKm232(AsyncKbGen):
+    """
+    Asynchronous counterpart of UsbKm232
+
+    The serial connection is switched to non-blocking mode once open, so
+    octets get written as the event loop finds the port writable. The
+    connection is kept by the SerialSession of UsbKm232, backing off upon
+    the event loop, and sequences are compiled by UsbKm232 itself.
+    Responses are not checked.
+    """
+
+    def __init__(self, logger, *args, **kwargs):
+        super().__init__(logger)
+        if kwargs.get('check_resp', '0') == '1':
+            raise KbHwError("check_resp is not supported by AsyncUsbKm232")
+        self.__km = UsbKm232(logger, *args, **kwargs)
+        self.session = self.__km.session
+        self.pacing = DeadlineScheduler() # Paces octets upon deadlines
+        self.trace = KbTrace(kwargs.get('kb_trace_size')) # Latencies recorded
+
+    async def open(self):
+        await self.__ensure()
+
+    async def __ensure(self):
+        """Returns the connection, reopened and made non-blocking if needed"""
+        conn = await self.session.ensure_async()
+        try:
+            os.set_blocking(conn.fileno(), False)
+        except (OSError, ValueError) as e:
+            self.logger.error(e)
+            self.session.close()
+            raise KbHwError("Problems performing serial connection")
+        return conn
+
+    async def perform(self, seq_file):
+
+        started = time.perf_counter()
+        program = self.__km.compile(seq_file)
+        self.trace.start()
+        self.trace.record(KbTrace.TRANSLATE, started)
+
+        conn = await self.__ensure()
+        fd = conn.fileno()
+        try:
+            self.pacing.start()
+            for payload, time_gap in program:
+                if payload:
+                    started = time.perf_counter()
+                    await asyncio.wait_for(write_fd(fd, payload),
+                        conn.write_timeout)
+                    self.trace.write(started)
+                await self.pacing.wait_async(time_gap)
+            self.logger.debug("pacing jitter: {0}".format(
+                self.pacing.jitter()))
+        except (OSError, asyncio.TimeoutError) as e:
+            self.logger.error(e)
+            # The connection is reopened by the next sequence
+            self.session.close()
+            raise KbHwError('Experimenting serial connection problems')
+        except asyncio.CancelledError:
+            # Leave no key being pressed upon the host
+            try:
+                os.write(fd, self.__km.BUFFER_CLEAR)
+            except OSError:
+                pass
+            raise
+
+    async def release(self):
+        self.session.close()
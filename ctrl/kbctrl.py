@@ -1,6 +1,11 @@
 from ctrl.ctrl import Ctrl
 from ctrl.ctrl import CtrlError, CtrlModuleError
-from ctrl.gen  import KbGen
+from ctrl.gen  import KbGen, AsyncKbGen
+from custom.profile import ProfileTree
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import time
 
 class KbCtrl(Ctrl):
     """
@@ -32,3 +37,119 @@ class KbCtrl(Ctrl):
         self.logger.debug("asking the {0} handler to release".format(
             self.model.__str__()))
         self.model.release()
+
+
+class AsyncKbCtrl(Ctrl):
+    """
+    Asynchronous keyboard emulator control class.
+
+    Implements the impt_aio_class of the hardware module, so a single event
+    loop might drive as many keyboards as needed.
+    """
+
+    IMPT_ATTR = "impt_aio_class"
+
+    def __init__(self, logger, ctrl_info=None):
+        super().__init__(logger, ctrl_info)
+
+    def verify_model(self):
+        if not isinstance(self.model, AsyncKbGen):
+            msg = "unknown support library specification in {0}".format(self.model)
+            raise CtrlModuleError(msg)
+
+    async def open(self):
+        """"""
+        self.logger.debug("asking the {0} handler to open".format(
+            self.model.__str__()))
+        await self.model.open()
+
+    async def perform(self, seq_file):
+        """"""
+        self.logger.debug("asking the {0} handler to perform {1}".format(
+            self.model.__str__(), seq_file))
+        await self.model.perform(seq_file)
+
+    async def release(self):
+        """"""
+        self.logger.debug("asking the {0} handler to release".format(
+            self.model.__str__()))
+        await self.model.release()
+
+
+# Outcome of an action upon a port, error stays None upon success
+PortResult = namedtuple('PortResult', ['elapsed', 'error'])
+
+
+class MultiKbCtrl(object):
+    """
+    Keyboard emulator control class upon several ports at once.
+
+    Every entry of the ports list is defined as a selected model is, along
+    with a name to refer to it. A KbCtrl is built per port and the actions
+    are carried out upon all of them in parallel.
+    """
+
+    def __init__(self, logger, ctrl_info=None):
+        self.logger = logger
+
+        if not ctrl_info:
+            raise CtrlError("Control hardware info not passed")
+
+        try:
+            ports = list(ctrl_info.ports)
+        except KeyError:
+            raise CtrlError("Control hardware info holds no ports")
+
+        self.ports = OrderedDict()
+        for i, port in enumerate(ports):
+            name = port.get('name', str(i))
+            if name in self.ports:
+                raise CtrlError("port {0} defined twice".format(name))
+            self.ports[name] = KbCtrl(logger, ProfileTree({'selected': port}))
+
+        if not self.ports:
+            raise CtrlError("Control hardware info holds no ports")
+
+    def open(self):
+        """opens every port, returning a PortResult per port name"""
+        return self.__on_ports(lambda kb, name: kb.open())
+
+    def perform(self, seq_files):
+        """
+        performs sequences upon every port, returning a PortResult per port
+        name
+
+        Args:
+            seq_files: either one sequence for all the ports or a dict
+                       holding the sequence of each port name, in which case
+                       just the ports named there are acted upon
+        """
+        if isinstance(seq_files, dict):
+            unknown = set(seq_files) - set(self.ports)
+            if unknown:
+                raise CtrlError("unknown ports {0}".format(sorted(unknown)))
+            return self.__on_ports(
+                lambda kb, name: kb.perform(seq_files[name]), seq_files)
+        return self.__on_ports(lambda kb, name: kb.perform(seq_files))
+
+    def release(self):
+        """releases every port, returning a PortResult per port name"""
+        return self.__on_ports(lambda kb, name: kb.release())
+
+    def __on_ports(self, action, names=None):
+        names = [n for n in self.ports if names is None or n in names]
+
+        def timed(name):
+            start = time.monotonic()
+            try:
+                action(self.ports[name], name)
+                error = None
+            except Exception as e:
+                self.logger.error("port {0} failed: {1}".format(name, e))
+                error = e
+            return PortResult(time.monotonic() - start, error)
+
+        with ThreadPoolExecutor(max_workers=len(names) or 1) as pool:
+            results = list(pool.map(timed, names))
+
+        return OrderedDict(zip(names, results))
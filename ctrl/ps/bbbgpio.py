@@ -1,25 +1,203 @@
 from ctrl.gen import PsGen
 from ctrl.gen import PsHwError, PsOutletError
 
+import asyncio
+import select
 import struct
+import threading
 import time
 import logging
 import os
 
 impt_class='BBBGpio'
 
+
+class GpioWatch(object):
+    """
+    Watcher of outlet state changes upon gpio pins
+
+    A thread blocks in poll() upon value files of their own, armed for
+    edge detection, so watching costs no CPU in between changes. Every
+    change is handed to the callbacks as (outlet, state, timestamp), the
+    state read as per the relay behaviour of the pin. A resync period
+    might be set to read every pin anyway once in a while, should edges
+    get lost or not be supported at all.
+    """
+
+    __EDGES = ('none', 'rising', 'falling', 'both')
+
+    def __init__(self, logger, pins, edge='both', resync=None):
+        if edge not in self.__EDGES:
+            raise PsOutletError("unknown gpio edge {0}".format(edge))
+        self.logger = logger
+        self.__pins = pins  # (outlet, value path, value when outlet on)
+        self.__edge = edge
+        self.__resync = float(resync) if resync else None
+        self.__callbacks = []
+        self.__closers = []
+        self.__lock = threading.Lock()
+        self.__fds = {}
+        self.__states = {}
+        self.__thread = None
+        self.__wake_r = self.__wake_w = None
+
+    def add_callback(self, callback):
+        with self.__lock:
+            self.__callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        with self.__lock:
+            self.__callbacks.remove(callback)
+
+    def start(self):
+        if self.__thread:
+            return self
+        try:
+            for outlet, path, on_value in self.__pins:
+                self.__arm(path)
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                except OSError as e:
+                    self.logger.error(e)
+                    raise PsOutletError(
+                        "GPIO file {0} can not be opened".format(path))
+                self.__fds[fd] = (outlet, on_value)
+                # Reading primes the notification upon the file
+                self.__states[outlet] = self.__read(fd)
+            self.__wake_r, self.__wake_w = os.pipe()
+        except Exception:
+            # Pins armed so far are not left open
+            self.__close_fds()
+            raise
+        self.__thread = threading.Thread(
+            target=self.__watch, name="gpio-watch", daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        if not self.__thread:
+            return
+        os.write(self.__wake_w, b'\0')
+        self.__thread.join()
+        self.__thread = None
+        for fd in (self.__wake_r, self.__wake_w):
+            os.close(fd)
+        self.__close_fds()
+        with self.__lock:
+            closers = list(self.__closers)
+        for close in closers:
+            close()
+
+    def states(self):
+        """Returns the last states seen by outlet"""
+        return dict(self.__states)
+
+    async def events(self):
+        """
+        Yields (outlet, state, timestamp) changes as they happen, until
+        the watch gets stopped
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # The loop got closed meanwhile
+                pass
+
+        deliver = lambda *event: put(event)
+        close = lambda: put(None)
+        self.add_callback(deliver)
+        with self.__lock:
+            self.__closers.append(close)
+        try:
+            while self.__thread:
+                event = await queue.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.remove_callback(deliver)
+            with self.__lock:
+                self.__closers.remove(close)
+
+    def __arm(self, value_path):
+        edge_path = os.path.join(os.path.dirname(value_path), 'edge')
+        try:
+            with open(edge_path, 'w') as ef:
+                ef.write(self.__edge)
+        except OSError as e:
+            if not self.__resync:
+                self.logger.error(e)
+                raise PsOutletError(
+                    "GPIO edge {0} can not be armed".format(edge_path))
+            self.logger.warning(
+                "GPIO edge {0} not armed, relying on resync".format(edge_path))
+
+    def __read(self, fd):
+        outlet, on_value = self.__fds[fd]
+        if os.pread(fd, 1, 0) == on_value:
+            return PsGen.OUTLET_ON
+        return PsGen.OUTLET_OFF
+
+    def __watch(self):
+        poller = select.poll()
+        for fd in self.__fds:
+            poller.register(fd, select.POLLPRI | select.POLLERR)
+        poller.register(self.__wake_r, select.POLLIN)
+        timeout = self.__resync * 1000 if self.__resync else None
+
+        while True:
+            try:
+                ready = [fd for fd, ev in poller.poll(timeout)]
+            except InterruptedError:
+                continue
+            if self.__wake_r in ready:
+                return
+            for fd in (ready or list(self.__fds)):
+                try:
+                    state = self.__read(fd)
+                except OSError as e:
+                    self.logger.error(e)
+                    continue
+                outlet = self.__fds[fd][0]
+                if state == self.__states[outlet]:
+                    continue
+                self.__states[outlet] = state
+                self.__notify(outlet, state, time.time())
+
+    def __notify(self, outlet, state, ts):
+        with self.__lock:
+            callbacks = list(self.__callbacks)
+        for callback in callbacks:
+            try:
+                callback(outlet, state, ts)
+            except Exception as e:
+                self.logger.error("gpio watch callback failed: {0}".format(e))
+
+    def __close_fds(self):
+        for fd in self.__fds:
+            os.close(fd)
+        self.__fds = {}
+
+
 class BBBGpio(PsGen):
     """
-    Control class for a bbb gpio
+    Control class for a bank of bbb gpios
+
+    Every outlet is driven by a pin of its own, as listed by gpio_pins
+    from the first outlet onwards, or else by the single gpio_pin. The
+    relay behaviour of each pin is set alike by gpio_nocs or gpio_noc.
+    Value files are kept open once used, being read and written at
+    offset zero.
     """
 
-    __SLOT_MAX = 1
-    __GPIOS_BASE_DIR = '/sys/class/gpio'
+    __DEFAULT_GPIOS_BASE_DIR = '/sys/class/gpio'
 
     def __init__(self, logger, *args, **kwargs):
 
-        super().__init__(logger, self.__SLOT_MAX)
-
         def det_noc(v):
             if v == self.OUTLET_ON:
                 return (self.OUTLET_OFF, self.OUTLET_ON)
@@ -30,59 +208,89 @@ class BBBGpio(PsGen):
                 'It was not possible to determine relay behaviour'
             )
 
-        self.__gpio_conf = {
-            'GPIO_PIN': kwargs.get('gpio_pin', None),
-            'GPIO_CUTTER_ON': None,
-            'GPIO_CUTTER_OFF': None
-        }
+        def listed(v):
+            return [i.strip() for i in v.split(',') if i.strip()]
+
+        pins = listed(kwargs.get('gpio_pins', kwargs.get('gpio_pin', None)) or '')
+        if not pins:
+            raise PsHwError('gpio pin has not been defined')
 
-        if not self.__gpio_conf['GPIO_PIN']:
-            raise PsError('gpio pin has not been defined')
+        nocs = listed(kwargs.get('gpio_nocs', kwargs.get('gpio_noc', self.OUTLET_ON)))
+        if len(nocs) == 1:
+            nocs = nocs * len(pins)
+        if len(nocs) != len(pins):
+            raise PsHwError('gpio_nocs does not match gpio_pins')
 
-        self.__gpio_conf['GPIO_CUTTER_ON'], self.__gpio_conf['GPIO_CUTTER_OFF'] = det_noc(
-           kwargs.get('gpio_noc', self.OUTLET_ON)
-        )
+        super().__init__(logger, len(pins))
 
-        self.__gpio_abs_path = "{0}/{1}/value".format(
-            self.__GPIOS_BASE_DIR,
-            self.__gpio_conf['GPIO_PIN']
-        )
+        base_dir = kwargs.get('gpio_base_dir', self.__DEFAULT_GPIOS_BASE_DIR)
+        self.__gpio_conf = []
+        for pin, noc in zip(pins, nocs):
+            cutter_on, cutter_off = det_noc(noc)
+            self.__gpio_conf.append({
+                'GPIO_PIN': pin,
+                'GPIO_CUTTER_ON': cutter_on.encode(),
+                'GPIO_CUTTER_OFF': cutter_off.encode(),
+                'GPIO_ABS_PATH': os.path.join(base_dir, pin, 'value'),
+            })
+        self.__fds = [None] * len(pins)
+
+    def close(self):
+        """Closes the value files kept open"""
+        for i, fd in enumerate(self.__fds):
+            if fd is not None:
+                os.close(fd)
+                self.__fds[i] = None
+
+    def watch(self, callback=None, outlets=None, edge='both', resync=None):
+        """
+        Starts watching outlets for state changes, all of them by default
+
+        Returns the GpioWatch, whose changes are handed to callback if
+        given, or might be iterated asynchronously through its events.
+        """
+        numbers = [self.__verify_outlet_range(o) for o in (
+            outlets or range(1, self.outlet_count + 1))]
+        watch = GpioWatch(self.logger, [
+            (n, self.__gpio_conf[n - 1]['GPIO_ABS_PATH'],
+                self.__gpio_conf[n - 1]['GPIO_CUTTER_ON'])
+            for n in numbers], edge, resync)
+        if callback:
+            watch.add_callback(callback)
+        return watch.start()
 
     def turn_outlet_off(self, outlet_number):
         """Turns a specified outlet off in cutter device"""
-        self.__verify_outlet_range(outlet_number)
-        self.__act_upon_outlet(self.__gpio_conf['GPIO_CUTTER_OFF'])
+        i = self.__verify_outlet_range(outlet_number) - 1
+        self.__act_upon_pin(i, self.__gpio_conf[i]['GPIO_CUTTER_OFF'])
 
 
     def turn_outlet_on(self, outlet_number):
         """Turns a specified outlet on in cutter device"""
-        self.__verify_outlet_range(outlet_number)
-        self.__act_upon_outlet(self.__gpio_conf['GPIO_CUTTER_ON'])
+        i = self.__verify_outlet_range(outlet_number) - 1
+        self.__act_upon_pin(i, self.__gpio_conf[i]['GPIO_CUTTER_ON'])
 
 
     def turn_all_outlets_on(self):
         """Turns all outlets on in cutter device."""
-        self.__act_upon_outlet(self.__gpio_conf['GPIO_CUTTER_ON'])
+        for i, conf in enumerate(self.__gpio_conf):
+            self.__act_upon_pin(i, conf['GPIO_CUTTER_ON'])
 
 
     def turn_all_outlets_off(self):
         """Turns all outlets off in cutter device."""
-        self.__act_upon_outlet(self.__gpio_conf['GPIO_CUTTER_OFF'])
+        for i, conf in enumerate(self.__gpio_conf):
+            self.__act_upon_pin(i, conf['GPIO_CUTTER_OFF'])
 
 
     def read_outlet(self, outlet_number):
         """Reads the requested outlet from cutter device"""
-        return self.read_all_outlets()[self.__verify_outlet_range(outlet_number)]
+        i = self.__verify_outlet_range(outlet_number) - 1
+        return self.__read_pin(i)
 
     def read_all_outlets(self):
         """Reads all outlets from cutter device."""
-        _UNIQUE_SLOT_INDEX = 1
-        rd = {}
-        fd = self.__open_virt_file()
-        gpio_val = fd.readline()
-        rd[_UNIQUE_SLOT_INDEX] = gpio_val.replace('\n', '')
-        fd.close()
-        return rd
+        return {i + 1: self.__read_pin(i) for i in range(self.outlet_count)}
 
     def __verify_outlet_range(self, outlet_number):
         i_onum = None
@@ -97,36 +305,41 @@ class BBBGpio(PsGen):
                 outlet_number))
         return i_onum
 
-    def __open_virt_file(self, writeable=False):
-        """opens sys virtual as per gpio"""
-        if not os.path.isfile(self.__gpio_abs_path):
+    def __virt_fd(self, i):
+        """Returns the descriptor of the value file of a pin, opened once"""
+        if self.__fds[i] is not None:
+            return self.__fds[i]
+        gpio_abs_path = self.__gpio_conf[i]['GPIO_ABS_PATH']
+        if not os.path.isfile(gpio_abs_path):
             emsg = "GPIO file {0} is not found".format(gpio_abs_path)
             self.logger.error(emsg)
             raise PsOutletError(emsg)
-        fd = None
         try:
-            mode = 'w' if writeable else 'r'
-            fd = open(self.__gpio_abs_path, mode)
-        except (OSError, IOError) as e:
+            self.__fds[i] = os.open(gpio_abs_path, os.O_RDWR)
+        except OSError as e:
             self.logger.error(e)
             emsg = "GPIO file {0} can not be opened".format(gpio_abs_path)
             self.logger.error(emsg)
             raise PsOutletError("GPIO file can not be loaded")
-        return fd
+        return self.__fds[i]
 
-    def __act_upon_outlet(self, state):
+    def __read_pin(self, i):
+        """Reads the outlet state of a pin as per its relay behaviour"""
+        try:
+            value = os.pread(self.__virt_fd(i), 1, 0)
+        except OSError as e:
+            self.logger.error(e)
+            raise PsOutletError("GPIO file can not be read")
+        if value == self.__gpio_conf[i]['GPIO_CUTTER_ON']:
+            return self.OUTLET_ON
+        return self.OUTLET_OFF
+
+    def __act_upon_pin(self, i, value):
         """
-        set GPIO pin to state
+        set GPIO pin to value
         """
-        switcher = [
-            (lambda f: f.write('0')),
-            (lambda f: f.write('1'))
-        ]
-        st = int(state)
-
-        if st < 0:
-            raise PsOutletError("There is not any negative gpio state")
-
-        fd = self.__open_virt_file(writeable=True)
-        switcher[st](fd)
-        fd.close()
+        try:
+            os.pwrite(self.__virt_fd(i), value, 0)
+        except OSError as e:
+            self.logger.error(e)
+            raise PsOutletError("GPIO file can not be written")
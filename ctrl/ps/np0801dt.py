@@ -6,15 +6,145 @@ At the time of the implementation, the reference website is:
 http://www.synaccess-net.com/np-0801dt/
 """
 
-from ctrl.gen import PsGen
+from ctrl.gen import PsGen, AsyncPsGen
 from ctrl.gen import PsHwError, PsOutletError
+from ctrl.trace import LatencyHistogram
 
+import asyncio
+import base64
+import collections
+import http.client
 import struct
+import threading
 import time
 import logging
 import os
+import urllib.parse
+import urllib.request
 
 impt_class='Np0801dt'
+impt_aio_class='AsyncNp0801dt'
+
+
+def cmd_query(inst_code, *args):
+    """Returns the unquoted query string of an instruction for cmd.cgi"""
+    url_params = [inst_code]
+    for a in [ d for d in args if d or d == 0 ]:
+        arg_str = a if isinstance(a, str) else str(a)
+        if arg_str:
+            url_params.append(" ")
+            url_params.append(arg_str)
+    return urllib.parse.unquote(''.join(url_params))
+
+
+def parse_monitor_reply(reply):
+    """Returns monitoring info."""
+    values = reply.decode('utf-8').split(',')
+
+    if values[0] == '$A0':
+        # Status vector should be 4 fields long hence the magic number
+        if len(values) == 4:
+            rv = {}
+            # data comes reversed so needs reversing
+            rv['ss'] = values[1][::-1]
+            rv['amps'] = values[2]
+            rv['temp'] = values[3]
+            return rv
+        raise PsHwError("RPS returned a malformed status vector")
+    elif values[0] == '$AF':
+        raise PsHwError("RPS returned error code: {0}".format(
+            values[0]))
+    else:
+        raise PsHwError("RPS unknown error")
+
+
+def shows(ss, expect):
+    """Tells whether a status vector shows the states expected by outlet"""
+    return all(ss[o - 1] == s for o, s in expect.items())
+
+
+def basic_auth(username, password):
+    """Returns the value of the Authorization header for the device"""
+    auth_str = "{0}:{1}".format(username, password)
+    return "Basic " + base64.b64encode(auth_str.encode('ascii')).decode('ascii')
+
+
+# Instructions of the CGI-API along with the time the device needs to
+# breathe after each one
+ACTIONS = {
+    'AlterAllSlots':{'inst_code':'$A7', 'breathe_time':6},
+    'AlterSlot':{'inst_code':'$A3', 'breathe_time':2},
+    'MonitorDevice':{'inst_code':'$A5', 'breathe_time':2},
+}
+
+# Adaptive settling polls the status vector, at growing intervals,
+# rather than keeping the breathe time after every instruction
+SETTLE_MODES = ('fixed', 'adaptive')
+DEFAULT_SETTLE_TIMEOUT = 10
+DEFAULT_SETTLE_POLL = 0.05
+SETTLE_POLL_MAX = 1
+# Weight of the last settle time on the learned one, and the share
+# of the latter waited before polling at all
+SETTLE_LEARN_RATE = 0.25
+SETTLE_LEAD = 0.8
+
+
+def settle_args(kwargs):
+    """Returns the settle mode, timeout and poll time given to a driver"""
+    mode = kwargs.get('settle_mode', 'fixed')
+    if mode not in SETTLE_MODES:
+        raise PsHwError("unknown settle mode {0}".format(mode))
+    return (mode,
+        float(kwargs.get('settle_timeout', DEFAULT_SETTLE_TIMEOUT)),
+        float(kwargs.get('settle_poll', DEFAULT_SETTLE_POLL)))
+
+
+class SettleSchedule(object):
+    """
+    Pace of the status vector polls awaiting the outcome of an instruction
+
+    Polling starts once most of the time learned for the instruction has
+    gone by, since asking earlier is hardly ever worth it, and then goes
+    on at intervals doubling from the settle poll time. Drivers wait as
+    told by wait() before every poll, then tell polled() whether the
+    outlets settled, which learns the time they took.
+    """
+
+    def __init__(self, settle_times, inst_code, timeout, poll):
+        self.__settle_times = settle_times
+        self.__inst_code = inst_code
+        self.__timeout = timeout
+        self.started = time.monotonic()
+        self.__deadline = self.started + timeout
+        self.__interval = poll
+        self.__wait = settle_times.get(inst_code, 0) * SETTLE_LEAD
+        self.took = None
+
+    def wait(self):
+        """Returns the seconds to wait before the next poll"""
+        wait = max(0, min(self.__wait, self.__deadline - time.monotonic()))
+        self.__wait = self.__interval
+        self.__interval = min(self.__interval * 2, SETTLE_POLL_MAX)
+        return wait
+
+    def polled(self, settled):
+        """
+        Returns whether polling is over, raising PsHwError instead should
+        the outlets not have settled within the settle timeout
+        """
+        now = time.monotonic()
+        if settled:
+            self.took = now - self.started
+            learned = self.__settle_times.get(self.__inst_code, self.took)
+            self.__settle_times[self.__inst_code] = learned + (
+                SETTLE_LEARN_RATE * (self.took - learned))
+            return True
+        if now >= self.__deadline:
+            raise PsHwError(
+                "outlets did not settle within {0}s upon {1}".format(
+                    self.__timeout, self.__inst_code))
+        return False
+
 
 class Np0801dt(PsGen):
 
@@ -24,11 +154,7 @@ class Np0801dt(PsGen):
     __DEFAULT_ADMIN = 'admin'
     __DEFAULT_PASSWORD = 'admin'
     __FAIL_CODE = b'$AF'
-    __ACTIONS = {
-        'AlterAllSlots':{'inst_code':'$A7', 'breathe_time':6},
-        'AlterSlot':{'inst_code':'$A3', 'breathe_time':2},
-        'MonitorDevice':{'inst_code':'$A5', 'breathe_time':2},
-    }
+    __DEFAULT_HTTP_TIMEOUT = 10
 
     def __init__(self, logger, *args, **kwargs):
         super().__init__(logger, self.__SLOT_MAX)
@@ -37,25 +163,74 @@ class Np0801dt(PsGen):
             'username':kwargs.get('username', self.__DEFAULT_ADMIN),
             'password':kwargs.get('password', self.__DEFAULT_PASSWORD),
         }
+        self.__headers = {
+            'Authorization': basic_auth(self.__adm_auth_info['username'],
+                self.__adm_auth_info['password']),
+            'Connection': 'keep-alive',
+        }
+        self.__http_timeout = float(
+            kwargs.get('http_timeout', self.__DEFAULT_HTTP_TIMEOUT))
+        self.__conn = None
+        # Instructions share the connection with telemetry sampling
+        self.__conn_lock = threading.RLock()
+        # Round trip times of the CGI-API keyed by instruction code
+        self.rtt = collections.defaultdict(LatencyHistogram)
+
+        (self.__settle_mode, self.__settle_timeout,
+            self.__settle_poll) = settle_args(kwargs)
+        # Time taken by the outlets to settle, learned by instruction code
+        self.settle_times = {}
+        # Breathe time owed by instructions sent unsettled, as per
+        # time.perf_counter, and outlet states they are expected to show
+        self.__breathe_until = 0
+        self.__pending = {}
+        self.__pending_code = None
+
+    def close(self):
+        """Closes the HTTP connection held with the device, if any"""
+        with self.__conn_lock:
+            if self.__conn:
+                self.__conn.close()
+                self.__conn = None
 
+    def rtt_summary(self):
+        """Returns the round trip times measured by instruction code"""
+        return {code: h.summary() for code, h in self.rtt.items()}
 
-    def __exec_inst(self, inst_code, breathe_time, cmd_arg_1, cmd_arg_2):
-        """Execute instruction over switch."""
-        import urllib.parse
-        import urllib.error
-        import time
-        url_params = [inst_code]
-        args = [ d for d in (cmd_arg_1, cmd_arg_2) if d or d == 0 ]
-        for a in (args):
-            arg_str = a if isinstance(a, str) else str(a)
-            if arg_str:
-                url_params.append(" ")
-                url_params.append(arg_str)
+    def __exec_inst(self, inst_code, breathe_time, cmd_arg_1, cmd_arg_2,
+            expect=None):
+        """Execute instruction over switch.
+
+        In adaptive settle mode the breathe time is not kept; instead the
+        status vector is polled until it shows the outlet states expected
+        from the instruction. Neither is done while settle is turned off
+        but once the outlets are waited for, the breathe time being kept
+        before any settled instruction anyway.
+        """
         try:
-            reply = self.__inject(urllib.parse.unquote(''.join(url_params)))
-            time.sleep(breathe_time)
+            if self.settle:
+                time.sleep(max(0, self.__breathe_until - time.perf_counter()))
+            started = time.perf_counter()
+            reply = self.__inject(cmd_query(inst_code, cmd_arg_1, cmd_arg_2))
+            self.rtt[inst_code].add(time.perf_counter() - started)
+            if expect:
+                self.applied_at = time.perf_counter()
+            if not self.settle:
+                if self.__settle_mode == 'fixed':
+                    self.__breathe_until = max(self.__breathe_until,
+                        time.perf_counter() + breathe_time)
+                elif expect and reply != self.__FAIL_CODE:
+                    self.__pending.update(expect)
+                    self.__pending_code = inst_code
+            elif self.__settle_mode == 'fixed':
+                time.sleep(breathe_time)
+            elif expect and reply != self.__FAIL_CODE:
+                self.__settle(inst_code, expect)
+                self.applied_at = time.perf_counter()
             return reply
-        except (urllib.error.URLError, urllib.error.HTTPError):
+        except (http.client.HTTPException, OSError) as e:
+            self.logger.error(e)
+            self.close()
             raise PsHwError("Problems with np-0801dt CGI-API")
 
 
@@ -63,45 +238,105 @@ class Np0801dt(PsGen):
         """Injects an instruction in np-0801dx CGI-API.
 
         It shall receive an unquote string to be pushed as parameters of a
-        HTTP-GET request
+        HTTP-GET request. The HTTP/1.1 connection is kept open across
+        instructions, and opened afresh once should the device have
+        dropped it meanwhile.
         """
-        import urllib.request
-        import base64
-        from array import array
-
-        auth_str = "{0}:{1}".format(self.__adm_auth_info['username'],
-            self.__adm_auth_info['password'])
-        answer = "http://{0}/cmd.cgi?{1}".format(self.__device_ip,
-            urllib.request.pathname2url(data))
-        basic64 = b"Basic " + base64.encodestring(
-            auth_str.encode('ascii')).replace(b'\n', b'')
-        req = urllib.request.Request(answer)
-        req.add_header("Authorization", basic64)
-        with urllib.request.urlopen(req) as response:
-            resp = response.read().replace(b'\r\n', b'')
-            self.logger.debug("RPS command response: {0}".format(resp))
-            return resp
-
-
-    def __parse_monitor_reply(self, reply):
-        """Returns monitoring info."""
-        values = reply.decode('utf-8').split(',')
-
-        if values[0] == '$A0':
-            # Status vector should be 4 fields long hence the magic number
-            if len(values) == 4:
-                rv = {}
-                # data comes reversed so needs reversing
-                rv['ss'] = values[1][::-1]
-                rv['amps'] = values[2]
-                rv['temp'] = values[3]
-                return rv
-        elif values[0] == '$AF':
-            raise PsHwError("RPS returned error code: {0}".format(
-                values[0]))
-        else:
-            raise PsHwError("RPS unknown error")
+        url = "/cmd.cgi?{0}".format(urllib.request.pathname2url(data))
+        with self.__conn_lock:
+            reused = self.__conn is not None
+            try:
+                resp = self.__request(url)
+            except (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                    ConnectionError) as e:
+                if not reused:
+                    raise
+                self.logger.debug("RPS connection dropped: {0}".format(e))
+                self.close()
+                resp = self.__request(url)
+        self.logger.debug("RPS command response: {0}".format(resp))
+        return resp
+
+    def __request(self, url):
+        if not self.__conn:
+            self.__conn = http.client.HTTPConnection(
+                self.__device_ip, timeout=self.__http_timeout)
+        self.__conn.request('GET', url, headers=self.__headers)
+        response = self.__conn.getresponse()
+        body = response.read()
+        if response.will_close:
+            self.close()
+        if response.status != http.client.OK:
+            raise http.client.HTTPException(
+                "RPS answered HTTP {0} {1}".format(
+                    response.status, response.reason))
+        return body.replace(b'\r\n', b'')
+
+
+    def wait_settled(self):
+        """
+        Waits for the instructions sent unsettled to take effect, keeping
+        the breathe time owed or polling until the outlets show them
+        """
+        expect, self.__pending = self.__pending, {}
+        try:
+            if self.__settle_mode == 'fixed':
+                time.sleep(max(0, self.__breathe_until - time.perf_counter()))
+            elif expect:
+                # Instructions went out a while ago, so nothing is learned
+                self.__settle(self.__pending_code, expect, {})
+        except (http.client.HTTPException, OSError) as e:
+            self.logger.error(e)
+            self.close()
+            raise PsHwError("Problems with np-0801dt CGI-API")
+
+    def discard_pending(self):
+        """Forgets what the instructions sent unsettled were owed"""
+        self.__pending = {}
+        self.__pending_code = None
+        self.__breathe_until = 0
+
+    def __settle(self, inst_code, expect, settle_times=None):
+        """
+        Polls the status vector until the outlets show the states expected
+        from an instruction, as paced by SettleSchedule
+        """
+        if settle_times is None:
+            settle_times = self.settle_times
+        schedule = SettleSchedule(settle_times, inst_code,
+            self.__settle_timeout, self.__settle_poll)
+        while True:
+            time.sleep(schedule.wait())
+            if schedule.polled(shows(self.__monitor()['ss'], expect)):
+                self.logger.debug("outlets settled in {0:.3f}s".format(
+                    schedule.took))
+                return
+
+    def __monitor(self):
+        """Reads the status vector, without keeping any breathe time"""
+        code = ACTIONS['MonitorDevice']['inst_code']
+        started = time.perf_counter()
+        reply = self.__inject(code)
+        self.rtt[code].add(time.perf_counter() - started)
+        return parse_monitor_reply(reply)
+
+    def read_monitor(self):
+        """
+        Reads the current drawn and the temperature off the device
 
+        No breathe time is kept, since the device is not altered, and the
+        connection is only held for the request, so reading is not held
+        back by instructions breathing meanwhile.
+        """
+        try:
+            info = self.__monitor()
+            return {'amps': float(info['amps']), 'temp': float(info['temp'])}
+        except (http.client.HTTPException, OSError) as e:
+            self.logger.error(e)
+            self.close()
+            raise PsHwError("Problems with np-0801dt CGI-API")
+        except ValueError:
+            raise PsHwError("RPS returned a malformed status vector")
 
     def read_outlet(self, outlet_number):
         try:
@@ -118,17 +353,17 @@ class Np0801dt(PsGen):
 
     def read_all_outlets(self):
         """Reads all outlets from RPS device."""
-        action = self.__ACTIONS['MonitorDevice']
+        action = ACTIONS['MonitorDevice']
         try:
             reply = self.__exec_inst(
                 action['inst_code'], action['breathe_time'],
                 None, None)
-            self.logger.debug("raw outlet status: {0}".format(
-                self.__parse_monitor_reply(reply)['ss']))
+            ss = parse_monitor_reply(reply)['ss']
+            self.logger.debug("raw outlet status: {0}".format(ss))
             d_outlet_status={}
             for si in range(self.outlet_count):
                 status = self.__SLOT_STATUS['OFF']
-                if self.__parse_monitor_reply(reply)['ss'][si] == '1':
+                if ss[si] == '1':
                     status = self.__SLOT_STATUS['ON']
 
                 # npd0801dt indexing is from 1 to 8 so +1 here
@@ -140,9 +375,50 @@ class Np0801dt(PsGen):
         except (PsHwError, PsOutletError):
             raise
 
+    def apply_state(self, changes, current):
+        """
+        Turns outlets upon the cheapest mix of $A7 and $A3 instructions
+
+        Turning all outlets into one state and then fixing those meant to
+        be otherwise beats turning every outlet in turn once the time of
+        $A7 is below that of the $A3 instructions it saves. Times are the
+        breathe ones, or those learned in adaptive settle mode. $A7 is only
+        sent into a state every outlet left unchanged is already in, so
+        those are never switched, not even for a while.
+        """
+        one = self.__cost('AlterSlot')
+        best_cost, best_state = len(changes) * one, None
+        for state in (self.OUTLET_ON, self.OUTLET_OFF):
+            if any(s != state for o, s in current.items() if o not in changes):
+                continue
+            rest = sum(1 for s in changes.values() if s != state)
+            cost = self.__cost('AlterAllSlots') + rest * one
+            if cost < best_cost:
+                best_cost, best_state = cost, state
+
+        if best_state is not None:
+            if best_state == self.OUTLET_ON:
+                self.turn_all_outlets_on()
+            else:
+                self.turn_all_outlets_off()
+            changes = {o: s for o, s in changes.items() if s != best_state}
+
+        for outlet, state in sorted(changes.items()):
+            if state == self.OUTLET_ON:
+                self.turn_outlet_on(outlet)
+            else:
+                self.turn_outlet_off(outlet)
+
+    def __cost(self, action_name):
+        action = ACTIONS[action_name]
+        if self.__settle_mode == 'adaptive':
+            return self.settle_times.get(
+                action['inst_code'], action['breathe_time'])
+        return action['breathe_time']
+
     def turn_outlet_on(self, outlet_number):
         """Turns a specified outlet on in RPS device."""
-        action = self.__ACTIONS['AlterSlot']
+        action = ACTIONS['AlterSlot']
         i_onum = int(outlet_number)
         if not i_onum or i_onum > self.outlet_count:
             raise PsOutletError("requested outlet {0} is out of range".format(
@@ -150,9 +426,10 @@ class Np0801dt(PsGen):
         try:
             reply = self.__exec_inst(
                 action['inst_code'], action['breathe_time'],
-                outlet_number, self.__SLOT_STATUS['ON'])
+                outlet_number, self.__SLOT_STATUS['ON'],
+                {i_onum: '1'})
             if reply == self.__FAIL_CODE:
-                self.logger.fatal("RPS returned fail code on cmd {0}", format(
+                self.logger.fatal("RPS returned fail code on cmd {0}".format(
                     action['inst_code']))
                 raise PsOutletError("RPS failed when turn outlet {0} on".format(
                     outlet_number))
@@ -162,7 +439,7 @@ class Np0801dt(PsGen):
 
     def turn_outlet_off(self, outlet_number):
         """Turns a specified outlet off in RPS device."""
-        action = self.__ACTIONS['AlterSlot']
+        action = ACTIONS['AlterSlot']
         i_onum = int(outlet_number)
         if not i_onum or i_onum > self.outlet_count:
             raise PsOutletError("requested outlet {0} is out of range".format(
@@ -170,9 +447,10 @@ class Np0801dt(PsGen):
         try:
             reply = self.__exec_inst(
                 action['inst_code'], action['breathe_time'],
-                outlet_number, self.__SLOT_STATUS['OFF'])
+                outlet_number, self.__SLOT_STATUS['OFF'],
+                {i_onum: '0'})
             if reply == self.__FAIL_CODE:
-                self.logger.fatal("RPS returned fail code on cmd {0}", format(
+                self.logger.fatal("RPS returned fail code on cmd {0}".format(
                     action['inst_code']))
                 raise PsOutletError(
                         "RPS failed turn outlet {0} off".format(outlet_number))
@@ -182,13 +460,14 @@ class Np0801dt(PsGen):
 
     def turn_all_outlets_on(self):
         """Turns all outlets on in RPS device."""
-        action = self.__ACTIONS['AlterAllSlots']
+        action = ACTIONS['AlterAllSlots']
         try:
             reply = self.__exec_inst(
                 action['inst_code'], action['breathe_time'],
-                self.__SLOT_STATUS['ON'], None)
+                self.__SLOT_STATUS['ON'], None,
+                dict.fromkeys(range(1, self.outlet_count + 1), '1'))
             if reply == self.__FAIL_CODE:
-                self.logger.fatal("RPS returned fail code on cmd {0}", format(
+                self.logger.fatal("RPS returned fail code on cmd {0}".format(
                     action['inst_code']))
                 raise PsOutletError("RPS failed when turn all outlets on")
         except (PsHwError, PsOutletError):
@@ -197,14 +476,239 @@ class Np0801dt(PsGen):
 
     def turn_all_outlets_off(self):
         """Turns all outlets off in RPS device."""
-        action = self.__ACTIONS['AlterAllSlots']
+        action = ACTIONS['AlterAllSlots']
         try:
             reply = self.__exec_inst(
                 action['inst_code'], action['breathe_time'],
-                self.__SLOT_STATUS['OFF'], None)
+                self.__SLOT_STATUS['OFF'], None,
+                dict.fromkeys(range(1, self.outlet_count + 1), '0'))
             if reply == self.__FAIL_CODE:
-                self.logger.fatal("RPS returned fail code on cmd {0}", format(
+                self.logger.fatal("RPS returned fail code on cmd {0}".format(
                     action['inst_code']))
                 raise PsOutletError("RPS failed when turn all outlets off")
         except (PsHwError, PsOutletError):
             raise
+
+
+class AsyncNp0801dt(AsyncPsGen):
+    """
+    Asynchronous counterpart of Np0801dt
+
+    Speaks HTTP/1.1 to cmd.cgi over a kept alive asyncio stream, so a
+    single event loop might drive as many devices as needed. Instructions
+    upon one device are serialized, breathe time or settling included,
+    as the device handles a single one at a time.
+    """
+
+    __SLOT_MAX = 8
+    __DEFAULT_SERVER_IP = '192.168.1.100'
+    __DEFAULT_ADMIN = 'admin'
+    __DEFAULT_PASSWORD = 'admin'
+    __DEFAULT_HTTP_TIMEOUT = 10
+    __FAIL_CODE = b'$AF'
+
+    def __init__(self, logger, *args, **kwargs):
+        super().__init__(logger, self.__SLOT_MAX)
+        self.device_ip = kwargs.get('device_ip', self.__DEFAULT_SERVER_IP)
+        host, _, port = self.device_ip.partition(':')
+        self.__addr = (host, int(port or 80))
+        self.__request_head = (
+            "GET {{0}} HTTP/1.1\r\n"
+            "Host: {0}\r\n"
+            "Authorization: {1}\r\n"
+            "Connection: keep-alive\r\n\r\n").format(
+                self.device_ip,
+                basic_auth(kwargs.get('username', self.__DEFAULT_ADMIN),
+                    kwargs.get('password', self.__DEFAULT_PASSWORD)))
+        self.__http_timeout = float(
+            kwargs.get('http_timeout', self.__DEFAULT_HTTP_TIMEOUT))
+        (self.__settle_mode, self.__settle_timeout,
+            self.__settle_poll) = settle_args(kwargs)
+
+        self.__reader = self.__writer = None
+        self.__lock = None
+        self.rtt = collections.defaultdict(LatencyHistogram)
+        self.settle_times = {}
+        self.errors = 0
+
+    async def close(self):
+        """Closes the HTTP connection held with the device, if any"""
+        writer, self.__reader, self.__writer = self.__writer, None, None
+        if writer:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError as e:
+                self.logger.debug(e)
+
+    def rtt_summary(self):
+        """Returns the round trip times measured by instruction code"""
+        return {code: h.summary() for code, h in self.rtt.items()}
+
+    async def __exec_inst(self, action_name, cmd_arg_1, cmd_arg_2,
+            expect=None):
+        """Execute instruction over switch, as Np0801dt does"""
+        action = ACTIONS[action_name]
+        inst_code = action['inst_code']
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            try:
+                reply = await self.__inject(
+                    inst_code, cmd_query(inst_code, cmd_arg_1, cmd_arg_2))
+                if self.__settle_mode == 'fixed':
+                    await asyncio.sleep(action['breathe_time'])
+                elif expect and reply != self.__FAIL_CODE:
+                    await self.__settle(inst_code, expect)
+                return reply
+            except (http.client.HTTPException, OSError,
+                    asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                self.logger.error("{0}: {1!r}".format(self.device_ip, e))
+                self.errors += 1
+                await self.close()
+                raise PsHwError("Problems with np-0801dt CGI-API")
+            except PsHwError:
+                self.errors += 1
+                raise
+
+    async def __inject(self, inst_code, data):
+        """
+        Injects an instruction in np-0801dx CGI-API, over a new connection
+        once should the device have dropped the one kept alive
+        """
+        url = "/cmd.cgi?{0}".format(urllib.request.pathname2url(data))
+        started = time.perf_counter()
+        reused = self.__writer is not None
+        try:
+            resp = await asyncio.wait_for(
+                self.__request(url), self.__http_timeout)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            if not reused:
+                raise
+            self.logger.debug("RPS connection dropped: {0!r}".format(e))
+            await self.close()
+            resp = await asyncio.wait_for(
+                self.__request(url), self.__http_timeout)
+        self.rtt[inst_code].add(time.perf_counter() - started)
+        self.logger.debug("RPS command response: {0}".format(resp))
+        return resp
+
+    async def __request(self, url):
+        if not self.__writer:
+            self.__reader, self.__writer = await asyncio.open_connection(
+                *self.__addr)
+        reader = self.__reader
+        self.__writer.write(self.__request_head.format(url).encode('ascii'))
+        await self.__writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("RPS closed the connection")
+        try:
+            version, status = status_line.split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise http.client.BadStatusLine(status_line)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+
+        will_close = headers.get('connection') == 'close' or (
+            version == b'HTTP/1.0' and headers.get('connection') != 'keep-alive')
+        if 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            body = await self.__read_chunked(reader)
+        else:
+            body = await reader.read()
+            will_close = True
+
+        if will_close:
+            await self.close()
+        if status != http.client.OK:
+            raise http.client.HTTPException(
+                "RPS answered HTTP {0}".format(status))
+        return body.replace(b'\r\n', b'')
+
+    async def __read_chunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        return b''.join(chunks)
+
+    async def __settle(self, inst_code, expect):
+        """Polls the status vector until settled, as Np0801dt does"""
+        schedule = SettleSchedule(self.settle_times, inst_code,
+            self.__settle_timeout, self.__settle_poll)
+        code = ACTIONS['MonitorDevice']['inst_code']
+        while True:
+            await asyncio.sleep(schedule.wait())
+            ss = parse_monitor_reply(await self.__inject(code, code))['ss']
+            if schedule.polled(shows(ss, expect)):
+                return
+
+    def __verify_outlet_range(self, outlet_number):
+        try:
+            i_onum = int(outlet_number)
+        except ValueError as e:
+            self.logger.debug(e)
+            msg = "incorrect type of outlet indexing, expecting an int"
+            raise PsOutletError(msg)
+        if i_onum < 1 or i_onum > self.outlet_count:
+            raise PsOutletError("requested outlet {0} is out of range".format(
+                outlet_number))
+        return i_onum
+
+    async def __alter(self, action_name, args, expect, failure):
+        reply = await self.__exec_inst(action_name, *args, expect=expect)
+        if reply == self.__FAIL_CODE:
+            self.logger.fatal("RPS {0} returned fail code on cmd {1}".format(
+                self.device_ip, ACTIONS[action_name]['inst_code']))
+            raise PsOutletError(failure)
+
+    async def read_all_outlets(self):
+        """Reads all outlets from RPS device."""
+        ss = parse_monitor_reply(
+            await self.__exec_inst('MonitorDevice', None, None))['ss']
+        return {si + 1: int(ss[si] == '1') for si in range(self.outlet_count)}
+
+    async def read_outlet(self, outlet_number):
+        i_onum = self.__verify_outlet_range(outlet_number)
+        return (await self.read_all_outlets())[i_onum]
+
+    async def turn_outlet_on(self, outlet_number):
+        """Turns a specified outlet on in RPS device."""
+        i_onum = self.__verify_outlet_range(outlet_number)
+        await self.__alter('AlterSlot', (i_onum, 1),
+            {i_onum: '1'},
+            "RPS failed when turn outlet {0} on".format(outlet_number))
+
+    async def turn_outlet_off(self, outlet_number):
+        """Turns a specified outlet off in RPS device."""
+        i_onum = self.__verify_outlet_range(outlet_number)
+        await self.__alter('AlterSlot', (i_onum, 0),
+            {i_onum: '0'},
+            "RPS failed turn outlet {0} off".format(outlet_number))
+
+    async def turn_all_outlets_on(self):
+        """Turns all outlets on in RPS device."""
+        await self.__alter('AlterAllSlots', (1, None),
+            dict.fromkeys(range(1, self.outlet_count + 1), '1'),
+            "RPS failed when turn all outlets on")
+
+    async def turn_all_outlets_off(self):
+        """Turns all outlets off in RPS device."""
+        await self.__alter('AlterAllSlots', (0, None),
+            dict.fromkeys(range(1, self.outlet_count + 1), '0'),
+            "RPS failed when turn all outlets off")
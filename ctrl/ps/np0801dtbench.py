@@ -0,0 +1,117 @@
+"""
+Benchmark of the np0801dt drivers against local simulators
+
+Runs outlet instructions through PsCtrl upon a single simulator, then
+through AsyncMultiPsCtrl upon many of them at once, printing latencies
+and throughput as json, so changes to the power switch stack can be
+measured in CI:
+
+    python3 -m ctrl.ps.np0801dtbench --devices 50 --rounds 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from ctrl.psctrl import PsCtrl, AsyncMultiPsCtrl
+from ctrl.ps.np0801dtsim import start_many
+from custom.profile import ProfileTree
+
+
+def selected(sim, name=None, **params):
+    """Returns the selected model definition of a driver upon a simulator"""
+    params.setdefault('device_ip', sim.device_ip)
+    # Breathe times would hide the driver, settling polls rather
+    params.setdefault('settle_mode', 'adaptive')
+    node = {
+        'mod_name': 'np0801dt',
+        'mod_params': [
+            {'name': k, 'value': str(v)} for k, v in params.items()],
+    }
+    if name:
+        node['name'] = name
+    return node
+
+
+def bench_sync(logger, sim, rounds):
+    """Reads and toggles an outlet rounds times upon one device"""
+    ps = PsCtrl(logger, ProfileTree({'selected': selected(sim)}))
+    started = time.perf_counter()
+    for r in range(rounds):
+        ps.read_all_outlets()
+        ps.turn_outlet_on(1 + r % ps.model.outlet_count)
+        ps.turn_outlet_off(1 + r % ps.model.outlet_count)
+    elapsed = time.perf_counter() - started
+    ps.model.close()
+    return {
+        'commands': rounds * 3,
+        'elapsed': elapsed,
+        'commands_per_second': rounds * 3 / elapsed,
+        'rtt': {code: {k: v for k, v in h.items() if k != 'buckets'}
+            for code, h in ps.model.rtt_summary().items()},
+    }
+
+
+async def bench_async(logger, sims, rounds, concurrency):
+    """Reads and turns all outlets rounds times upon every device at once"""
+    multi = AsyncMultiPsCtrl(logger, ProfileTree({
+        'devices': [selected(s, 'pdu{0}'.format(i)) for i, s in enumerate(sims)],
+        'concurrency': str(concurrency),
+    }))
+    errors = 0
+    started = time.perf_counter()
+    for r in range(rounds):
+        for action in (multi.read_all_outlets, multi.turn_all_outlets_on,
+                multi.turn_all_outlets_off):
+            results = await action()
+            errors += sum(1 for res in results.values() if res.error)
+    elapsed = time.perf_counter() - started
+    await multi.close()
+
+    commands = rounds * 3 * len(sims)
+    p99s = sorted(
+        max(h['p99'] for h in rtt.values())
+        for rtt in multi.latencies().values())
+    return {
+        'devices': len(sims),
+        'commands': commands,
+        'errors': errors,
+        'elapsed': elapsed,
+        'commands_per_second': commands / elapsed,
+        'device_p99_median': p99s[len(p99s) // 2] if p99s else 0.0,
+        'device_p99_max': p99s[-1] if p99s else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--settle-time', type=float, default=0)
+    parser.add_argument('--fail-rate', type=float, default=0)
+    parser.add_argument('--drop-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    logger = logging.getLogger('np0801dtbench')
+    sims = start_many(args.devices, latency=args.latency,
+        settle_time=args.settle_time, fail_rate=args.fail_rate,
+        drop_rate=args.drop_rate, seed=args.seed)
+    try:
+        report = {
+            'sync': bench_sync(logger, sims[0], args.rounds),
+            'async': asyncio.run(
+                bench_async(logger, sims, args.rounds, args.concurrency)),
+        }
+    finally:
+        for sim in sims:
+            sim.stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Simulator of the np0801dt remote power switch
+
+Serves the cmd.cgi CGI-API on localhost, understanding the $A3, $A5 and
+$A7 instructions behind Basic authentication, and keeps the state of the
+outlets. Latency, $AF failures and dropped connections might be injected
+so the drivers get exercised without a physical device. Many simulators
+can run at once, each one upon its own port:
+
+    python3 -m ctrl.ps.np0801dtsim --count 50 --latency 0.01
+"""
+import argparse
+import base64
+import random
+import socket
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class Np0801dtSim(ThreadingHTTPServer):
+    """
+    Simulated np0801dt device listening upon a local port
+
+    Args:
+        port: Port to listen to, an ephemeral one if 0.
+        latency: Seconds waited before answering every instruction.
+        settle_time: Seconds taken by outlets to switch after being told.
+        fail_rate: Probability of answering $AF to $A3 and $A7.
+        drop_rate: Probability of closing the connection with no answer.
+        seed: Seed of the random failures, for runs to be repeatable.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    SLOTS = 8
+    AMPS_PER_OUTLET = 0.35
+    TEMP = 25
+
+    def __init__(self, port=0, username='admin', password='admin',
+            latency=0, settle_time=0, fail_rate=0, drop_rate=0, seed=None,
+            host='127.0.0.1'):
+        super().__init__((host, port), _CmdHandler)
+        self.auth = "Basic " + base64.b64encode("{0}:{1}".format(
+            username, password).encode('ascii')).decode('ascii')
+        self.latency = float(latency)
+        self.settle_time = float(settle_time)
+        self.fail_rate = float(fail_rate)
+        self.drop_rate = float(drop_rate)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.outlets = ['0'] * self.SLOTS
+        self.pending = []   # (due time, outlet index, state) not yet settled
+        self.requests = {}  # count by instruction code
+        self.__thread = None
+
+    @property
+    def device_ip(self):
+        """Address to be fed to the drivers as device_ip"""
+        return "{0}:{1}".format(*self.server_address[:2])
+
+    def start(self):
+        """Serves requests from a background thread"""
+        self.__thread = threading.Thread(
+            target=self.serve_forever, name="np0801dtsim", daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+
+    def status(self):
+        """Returns the outlet states, ordered from the first outlet"""
+        with self.lock:
+            self.__settle()
+            return ''.join(self.outlets)
+
+    def execute(self, inst):
+        """Runs an instruction, returning the reply of the device"""
+        args = inst.split()
+        code = args[0] if args else ''
+        with self.lock:
+            self.requests[code] = self.requests.get(code, 0) + 1
+            self.__settle()
+            try:
+                if code == '$A5':
+                    on = self.outlets.count('1')
+                    # The status vector comes from the last outlet down
+                    return "$A0,{0},{1:.2f},{2}".format(
+                        ''.join(reversed(self.outlets)),
+                        on * self.AMPS_PER_OUTLET, self.TEMP)
+                if code == '$A3':
+                    outlet, state = int(args[1]), args[2]
+                    if not 1 <= outlet <= self.SLOTS or state not in ('0', '1'):
+                        return "$AF"
+                    return self.__alter([outlet - 1], state)
+                if code == '$A7':
+                    if args[1] not in ('0', '1'):
+                        return "$AF"
+                    return self.__alter(range(self.SLOTS), args[1])
+            except (IndexError, ValueError):
+                pass
+        return "$AF"
+
+    def __alter(self, slots, state):
+        if self.random.random() < self.fail_rate:
+            return "$AF"
+        due = time.monotonic() + self.settle_time
+        for s in slots:
+            self.pending.append((due, s, state))
+        self.__settle()
+        return "$A0"
+
+    def __settle(self):
+        now = time.monotonic()
+        while self.pending and self.pending[0][0] <= now:
+            due, slot, state = self.pending.pop(0)
+            self.outlets[slot] = state
+
+
+class _CmdHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Answers go out in a single write, Nagle would only delay them
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        sim = self.server
+        path, _, query = self.path.partition('?')
+        if path != '/cmd.cgi':
+            return self.__reply(404, b'')
+        if self.headers.get('Authorization') != sim.auth:
+            return self.__reply(401, b'',
+                [('WWW-Authenticate', 'Basic realm="np0801dt"')])
+
+        if sim.drop_rate and sim.random.random() < sim.drop_rate:
+            self.close_connection = True
+            return
+        if sim.latency:
+            time.sleep(sim.latency)
+        reply = sim.execute(urllib.parse.unquote(query))
+        self.__reply(200, (reply + "\r\n").encode('ascii'))
+
+    def __reply(self, status, body, headers=()):
+        head = ["HTTP/1.1 {0} {1}".format(status, self.responses[status][0]),
+            "Content-Type: text/plain",
+            "Content-Length: {0}".format(len(body))]
+        head.extend("{0}: {1}".format(k, v) for k, v in headers)
+        self.wfile.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_many(count, base_port=0, **kwargs):
+    """
+    Starts count simulators upon consecutive ports from base_port, or
+    upon ephemeral ones if it is 0, returning them
+    """
+    return [
+        Np0801dtSim(base_port + i if base_port else 0, **kwargs).start()
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--base-port', type=int, default=8080)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--settle-time', type=float, default=0)
+    parser.add_argument('--fail-rate', type=float, default=0)
+    parser.add_argument('--drop-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    sims = start_many(args.count, args.base_port, username=args.username,
+        password=args.password, latency=args.latency,
+        settle_time=args.settle_time, fail_rate=args.fail_rate,
+        drop_rate=args.drop_rate, seed=args.seed)
+    for sim in sims:
+        print(sim.device_ip, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for sim in sims:
+            sim.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,108 @@
 from ctrl.ctrl import Ctrl
 from ctrl.ctrl import CtrlError, CtrlModuleError
-from ctrl.gen  import PsGen
+from ctrl.gen  import PsGen, AsyncPsGen
+from ctrl.gen  import PsOutletError
+from ctrl.sched import DeadlineScheduler
+from ctrl.telemetry import TelemetrySampler
+from custom.profile import ProfileReader, ProfileTree
+from collections import OrderedDict, namedtuple
+
+import threading
+import time
+
+
+class OutletCache(object):
+    """
+    Outlet states read off a power switch, held for a time to live
+
+    Reads missing the cache while another one is in flight wait for it
+    and share its result, rather than querying the device themselves.
+    A read in flight while the cache gets invalidated is handed to those
+    already waiting for it but not kept, and reads starting afterwards
+    query the device afresh.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__states = None
+        self.__stamp = 0
+        self.__generation = 0
+        self.__flight = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, read):
+        """Returns the outlet states, calling read if they are not held"""
+        with self.__lock:
+            if (self.__states is not None and
+                    time.monotonic() - self.__stamp < self.ttl):
+                self.hits += 1
+                return dict(self.__states)
+            flight = self.__flight
+            leader = flight is None
+            if leader:
+                flight = self.__flight = _Flight(self.__generation)
+                self.misses += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return dict(flight.states)
+
+        try:
+            flight.states = read()
+            return dict(flight.states)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.__lock:
+                if flight.error is None and flight.generation == self.__generation:
+                    self.__states = flight.states
+                    self.__stamp = time.monotonic()
+                if self.__flight is flight:
+                    self.__flight = None
+            flight.done.set()
+
+    def invalidate(self):
+        with self.__lock:
+            self.__states = None
+            self.__generation += 1
+            self.__flight = None
+
+
+class _Flight(object):
+    """A read of the outlet states in progress"""
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.states = None
+        self.error = None
 
 
 class PsCtrl(Ctrl):
     """
     Power switch control class.
+
+    Outlet states read are cached for the cache_ttl seconds optionally
+    set in the control hardware info, zero by default. Turning outlets
+    through this class invalidates the cache.
     """
 
     def __init__(self, logger, ctrl_info=None):
         super().__init__(logger, ctrl_info)
+        try:
+            ttl = float(ProfileReader.get_content(
+                ctrl_info.cache_ttl, ProfileReader.PNODE_UNIQUE))
+        except KeyError:
+            ttl = 0
+        except ValueError:
+            raise CtrlError("cache_ttl is expected to be a number of seconds")
+        self.cache = OutletCache(ttl)
+        self.telemetry = None
 
     def verify_model(self):
         if not isinstance(self.model, PsGen) and not issubclass(self.model.__class__, PsGen):
@@ -19,12 +112,18 @@ class PsCtrl(Ctrl):
     def turn_all_outlets_on(self):
         """turns all the power switch outlets on."""
         self.logger.debug("asking the PS handler to turn all on")
-        self.model.turn_all_outlets_on()
+        try:
+            self.model.turn_all_outlets_on()
+        finally:
+            self.cache.invalidate()
 
     def turn_all_outlets_off(self):
         """turns all the power switch outlets off."""
         self.logger.debug("asking the PS handler to turn all off")
-        self.model.turn_all_outlets_off()
+        try:
+            self.model.turn_all_outlets_off()
+        finally:
+            self.cache.invalidate()
 
     def turn_outlet_on(self, outlet_number):
         """turns a single power switch outlet on."""
@@ -32,7 +131,10 @@ class PsCtrl(Ctrl):
             "asking the PS handler to turn {0} outlet on".format(
                 outlet_number)
         )
-        self.model.turn_outlet_on(outlet_number)
+        try:
+            self.model.turn_outlet_on(outlet_number)
+        finally:
+            self.cache.invalidate()
 
     def turn_outlet_off(self, outlet_number):
         """turns a single power switch outlet off."""
@@ -40,14 +142,193 @@ class PsCtrl(Ctrl):
             "asking the PS handler to turn {0} outlet off".format(
                 outlet_number)
         )
-        self.model.turn_outlet_off(outlet_number)
+        try:
+            self.model.turn_outlet_off(outlet_number)
+        finally:
+            self.cache.invalidate()
+
+    def apply_state(self, states):
+        """
+        sets outlets as per a dict of outlet number to state.
+
+        Only the outlets differing from their current state are turned,
+        as the model finds cheaper, then the outcome is verified with a
+        single read. Returns the states read afterwards.
+        """
+        desired = {}
+        for outlet, state in states.items():
+            try:
+                i_onum = int(outlet)
+                st = str(int(state))
+            except (TypeError, ValueError) as e:
+                self.logger.debug(e)
+                raise PsOutletError(
+                    "incorrect state {0} for outlet {1}".format(state, outlet))
+            if i_onum < 1 or i_onum > self.model.outlet_count:
+                raise PsOutletError(
+                    "requested outlet {0} is out of range".format(outlet))
+            if st not in (PsGen.OUTLET_ON, PsGen.OUTLET_OFF):
+                raise PsOutletError(
+                    "incorrect state {0} for outlet {1}".format(state, outlet))
+            desired[i_onum] = st
+
+        current = {o: str(s) for o, s in self.read_all_outlets().items()}
+        changes = {o: s for o, s in desired.items() if current[o] != s}
+        if not changes:
+            return current
+
+        self.logger.debug(
+            "asking the PS handler to turn outlets {0}".format(changes))
+        try:
+            self.model.apply_state(changes, current)
+        finally:
+            self.cache.invalidate()
+
+        after = {o: str(s) for o, s in self.read_all_outlets().items()}
+        failed = sorted(o for o, s in desired.items() if after[o] != s)
+        if failed:
+            raise PsOutletError(
+                "outlets {0} did not reach the requested state".format(failed))
+        return after
 
     def read_all_outlets(self):
         """reads all the power switch outlets."""
         self.logger.debug(
             "asking the PS handler to read all outlets"
         )
-        return self.model.read_all_outlets()
+        return self.cache.get(self.model.read_all_outlets)
+
+    def power_cycle(self, outlets=None, hold=1.0, spacing=0):
+        """
+        turns outlets off, all of them by default, then back on once they
+        were held off for hold seconds, spaced apart by spacing seconds.
+
+        The hold is kept upon deadlines from the moment every outlet got
+        turned off, as told by the model. Turns are sent unsettled, so
+        the offs go out back to back and the ons upon their deadlines
+        whatever the model waits after them. All outlets are turned at
+        once when the model is asked to cycle all of them. Returns the
+        hold measured per outlet.
+        """
+        numbers = self.__outlet_numbers(outlets)
+        self.logger.debug("asking the PS handler to power cycle {0}".format(
+            numbers))
+        try:
+            with self.model.unsettled():
+                off_at, on_at = self.__cycle(numbers, hold, spacing)
+        finally:
+            self.cache.invalidate()
+
+        held = {n: on_at[n] - off_at[n] for n in numbers}
+        self.logger.debug("outlets held off for {0}".format(held))
+        return held
+
+    def power_on(self, outlets=None, spacing=0):
+        """
+        turns outlets on, all of them by default, spaced apart by spacing
+        seconds so their inrush currents do not add up.
+
+        Returns the time each outlet got turned on at, in seconds since
+        the first one.
+        """
+        numbers = self.__outlet_numbers(outlets)
+        self.logger.debug("asking the PS handler to power on {0}".format(
+            numbers))
+        if not numbers:
+            return {}
+        try:
+            with self.model.unsettled():
+                on_at = self.__stagger_on(numbers, spacing, {})
+        finally:
+            self.cache.invalidate()
+        first = min(on_at.values())
+        return {n: on_at[n] - first for n in numbers}
+
+    def __cycle(self, numbers, hold, spacing):
+        """
+        Turns outlets off and back on after hold, returning when each one
+        got turned off and on
+        """
+        if len(numbers) > 1 and len(numbers) == self.model.outlet_count:
+            self.model.turn_all_outlets_off()
+            off_at = dict.fromkeys(numbers, self.__applied_at())
+        else:
+            off_at = {}
+            for n in numbers:
+                self.model.turn_outlet_off(n)
+                off_at[n] = self.__applied_at()
+
+        return off_at, self.__stagger_on(numbers, spacing,
+            {n: t + hold for n, t in off_at.items()})
+
+    def __stagger_on(self, numbers, spacing, not_before):
+        """
+        Turns outlets on in turn, each one no earlier than its not_before
+        deadline nor than spacing after the previous one, returning when
+        each one took effect
+        """
+        if (not spacing and len(numbers) > 1 and
+                len(numbers) == self.model.outlet_count):
+            pacing = DeadlineScheduler()
+            pacing.wait_until(max(not_before.values(), default=0))
+            self.model.turn_all_outlets_on()
+            return dict.fromkeys(numbers, self.__applied_at())
+
+        pacing = DeadlineScheduler()
+        on_at = {}
+        last = None
+        for n in sorted(numbers, key=lambda n: not_before.get(n, 0)):
+            deadline = not_before.get(n, 0)
+            if last is not None:
+                deadline = max(deadline, last + spacing)
+            pacing.wait_until(deadline)
+            self.model.turn_outlet_on(n)
+            on_at[n] = last = self.__applied_at()
+        return on_at
+
+    def __applied_at(self):
+        """Time the last turn took effect at, as told by the model"""
+        applied_at = self.model.applied_at
+        self.model.applied_at = None
+        return applied_at if applied_at is not None else time.perf_counter()
+
+    def __outlet_numbers(self, outlets):
+        if outlets is None:
+            return list(range(1, self.model.outlet_count + 1))
+        numbers = []
+        for outlet in outlets:
+            try:
+                i_onum = int(outlet)
+            except (TypeError, ValueError) as e:
+                self.logger.debug(e)
+                msg = "incorrect type of outlet indexing, expecting an int"
+                raise PsOutletError(msg)
+            if i_onum < 1 or i_onum > self.model.outlet_count:
+                raise PsOutletError(
+                    "requested outlet {0} is out of range".format(outlet))
+            if i_onum not in numbers:
+                numbers.append(i_onum)
+        return numbers
+
+    def start_telemetry(self, period=None, size=None):
+        """
+        starts sampling the current drawn and the temperature in the
+        background, every period seconds, returning the TelemetrySampler.
+
+        Only models offering read_monitor are supported.
+        """
+        if not hasattr(self.model, 'read_monitor'):
+            raise CtrlError("{0} offers no telemetry".format(self.model))
+        if not self.telemetry:
+            self.telemetry = TelemetrySampler(self.logger,
+                self.model.read_monitor, ('amps', 'temp'), period, size)
+        self.telemetry.start()
+        return self.telemetry
+
+    def stop_telemetry(self):
+        """stops sampling, keeping the samples taken."""
+        if self.telemetry:
+            self.telemetry.stop()
 
     def read_outlet(self, outlet_number):
         """reads a single power switch outlet."""
@@ -55,4 +336,188 @@ class PsCtrl(Ctrl):
             "asking the PS handler to read {0} outlet".format(
                 outlet_number)
             )
-        return self.model.read_outlet(outlet_number)
+        try:
+            i_onum = int(outlet_number)
+        except ValueError as e:
+            self.logger.debug(e)
+            msg = "incorrect type of outlet indexing, expecting an int"
+            raise PsOutletError(msg)
+        if i_onum < 1 or i_onum > self.model.outlet_count:
+            raise PsOutletError("requested outlet {0} is out of range".format(
+                outlet_number))
+        return self.cache.get(self.model.read_all_outlets)[i_onum]
+
+
+class AsyncPsCtrl(Ctrl):
+    """
+    Asynchronous power switch control class.
+
+    Implements the impt_aio_class of the hardware module, so a single event
+    loop might drive as many power switches as needed.
+    """
+
+    IMPT_ATTR = "impt_aio_class"
+
+    def __init__(self, logger, ctrl_info=None):
+        super().__init__(logger, ctrl_info)
+
+    def verify_model(self):
+        if not isinstance(self.model, AsyncPsGen):
+            msg = "unknown support library specification in {0}".format(self.model)
+            raise CtrlModuleError(msg)
+
+    async def turn_all_outlets_on(self):
+        """turns all the power switch outlets on."""
+        self.logger.debug("asking the PS handler to turn all on")
+        await self.model.turn_all_outlets_on()
+
+    async def turn_all_outlets_off(self):
+        """turns all the power switch outlets off."""
+        self.logger.debug("asking the PS handler to turn all off")
+        await self.model.turn_all_outlets_off()
+
+    async def turn_outlet_on(self, outlet_number):
+        """turns a single power switch outlet on."""
+        self.logger.debug(
+            "asking the PS handler to turn {0} outlet on".format(
+                outlet_number)
+        )
+        await self.model.turn_outlet_on(outlet_number)
+
+    async def turn_outlet_off(self, outlet_number):
+        """turns a single power switch outlet off."""
+        self.logger.debug(
+            "asking the PS handler to turn {0} outlet off".format(
+                outlet_number)
+        )
+        await self.model.turn_outlet_off(outlet_number)
+
+    async def read_all_outlets(self):
+        """reads all the power switch outlets."""
+        self.logger.debug(
+            "asking the PS handler to read all outlets"
+        )
+        return await self.model.read_all_outlets()
+
+    async def read_outlet(self, outlet_number):
+        """reads a single power switch outlet."""
+        self.logger.debug(
+            "asking the PS handler to read {0} outlet".format(
+                outlet_number)
+            )
+        return await self.model.read_outlet(outlet_number)
+
+    async def close(self):
+        """releases the connection to the power switch."""
+        await self.model.close()
+
+
+# Outcome of an action upon a device, error stays None upon success
+DeviceResult = namedtuple('DeviceResult', ['elapsed', 'error', 'value'])
+
+
+class AsyncMultiPsCtrl(object):
+    """
+    Power switch control class upon many devices at once.
+
+    Every entry of the devices list is defined as a selected model is,
+    along with a name to refer to it. An AsyncPsCtrl is built per device
+    and actions are carried out upon all of them concurrently, up to the
+    concurrency limit optionally set in the control hardware info. Each
+    device runs its own actions one at a time.
+    """
+
+    __DEFAULT_CONCURRENCY = 16
+
+    def __init__(self, logger, ctrl_info=None):
+        self.logger = logger
+
+        if not ctrl_info:
+            raise CtrlError("Control hardware info not passed")
+
+        try:
+            devices = list(ctrl_info.devices)
+        except KeyError:
+            raise CtrlError("Control hardware info holds no devices")
+
+        try:
+            self.concurrency = int(ProfileReader.get_content(
+                ctrl_info.concurrency, ProfileReader.PNODE_UNIQUE))
+        except KeyError:
+            self.concurrency = self.__DEFAULT_CONCURRENCY
+        except ValueError:
+            raise CtrlError("concurrency is expected to be a number")
+
+        self.devices = OrderedDict()
+        for i, device in enumerate(devices):
+            name = device.get('name', str(i))
+            if name in self.devices:
+                raise CtrlError("device {0} defined twice".format(name))
+            self.devices[name] = AsyncPsCtrl(
+                logger, ProfileTree({'selected': device}))
+
+        if not self.devices:
+            raise CtrlError("Control hardware info holds no devices")
+
+    async def turn_all_outlets_on(self, names=None):
+        """turns all outlets on, returning a DeviceResult per device name"""
+        return await self.__on_devices(
+            lambda ps: ps.turn_all_outlets_on(), names)
+
+    async def turn_all_outlets_off(self, names=None):
+        """turns all outlets off, returning a DeviceResult per device name"""
+        return await self.__on_devices(
+            lambda ps: ps.turn_all_outlets_off(), names)
+
+    async def turn_outlet_on(self, outlet_number, names=None):
+        """turns an outlet on, returning a DeviceResult per device name"""
+        return await self.__on_devices(
+            lambda ps: ps.turn_outlet_on(outlet_number), names)
+
+    async def turn_outlet_off(self, outlet_number, names=None):
+        """turns an outlet off, returning a DeviceResult per device name"""
+        return await self.__on_devices(
+            lambda ps: ps.turn_outlet_off(outlet_number), names)
+
+    async def read_all_outlets(self, names=None):
+        """
+        reads all outlets, returning a DeviceResult per device name whose
+        value holds the outlet states
+        """
+        return await self.__on_devices(
+            lambda ps: ps.read_all_outlets(), names)
+
+    async def close(self):
+        """releases the connection to every device"""
+        return await self.__on_devices(lambda ps: ps.close())
+
+    def latencies(self):
+        """Returns the round trip times measured per device name"""
+        return OrderedDict(
+            (name, ps.model.rtt_summary()) for name, ps in self.devices.items()
+            if hasattr(ps.model, 'rtt_summary'))
+
+    async def __on_devices(self, action, names=None):
+        # Synchronous controllers are spared the import of asyncio
+        import asyncio
+
+        if names is not None:
+            unknown = set(names) - set(self.devices)
+            if unknown:
+                raise CtrlError("unknown devices {0}".format(sorted(unknown)))
+        names = [n for n in self.devices if names is None or n in names]
+        limit = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def timed(name):
+            async with limit:
+                start = time.monotonic()
+                try:
+                    value = await action(self.devices[name])
+                    error = None
+                except Exception as e:
+                    self.logger.error("device {0} failed: {1}".format(name, e))
+                    value, error = None, e
+                return DeviceResult(time.monotonic() - start, error, value)
+
+        results = await asyncio.gather(*(timed(n) for n in names))
+        return OrderedDict(zip(names, results))
@@ -0,0 +1,162 @@
+"""
+Registry of the hardware modules backing the controllers.
+
+Profiles name hardware modules by their short name, which the registry
+maps onto the module implementing it. Modules are declared by the
+built-in manifest below, by json manifests loaded on demand, or by the
+'mimic.backends' entry points of installed packages, and are imported
+only once a controller asks for them. Classes resolved are cached, and
+the time every import took is kept for report.
+
+A json manifest holds an object mapping short names onto module paths:
+
+    {"mykb": "mypackage.mykb"}
+"""
+import importlib
+import importlib.util
+import json
+import threading
+import time
+
+ENTRY_POINT_GROUP = 'mimic.backends'
+
+# Hardware modules shipped along
+MANIFEST = {
+    'bbbkb': 'ctrl.kb.bbbkb',
+    'usbkm232': 'ctrl.kb.usbkm232',
+    'simkb': 'ctrl.kb.simkb',
+    'np0801dt': 'ctrl.ps.np0801dt',
+    'bbbgpio': 'ctrl.ps.bbbgpio',
+}
+
+# Packages looked into for modules declared nowhere, as hardware modules
+# dropped into them used to be found by their bare name
+PACKAGES = ('ctrl.kb', 'ctrl.ps')
+
+
+class BackendRegistry(object):
+    """
+    Resolves hardware module names onto the classes implementing them
+
+    The class of a module is the one named by a module attribute, such as
+    impt_class, so a module might implement several flavors of it. Names
+    declared nowhere are looked for within PACKAGES first, then imported
+    as plain module paths.
+    """
+
+    def __init__(self, manifest=None):
+        self.__modules = dict(MANIFEST if manifest is None else manifest)
+        self.__classes = {}
+        self.__imports = {}
+        self.__entry_points = None
+        self.__lock = threading.RLock()
+
+    def register(self, name, module_path):
+        """Declares the module implementing a name, replacing any other"""
+        with self.__lock:
+            self.__modules[name] = module_path
+            for key in [k for k in self.__classes if k[0] == name]:
+                del self.__classes[key]
+
+    def load_manifest(self, manifest_path):
+        """Declares the modules held by a json manifest"""
+        with open(manifest_path) as mf:
+            manifest = json.load(mf)
+        if not isinstance(manifest, dict):
+            raise ValueError(
+                "manifest {0} is not a json object".format(manifest_path))
+        for name, module_path in manifest.items():
+            self.register(name, module_path)
+
+    def names(self):
+        """Returns the module names declared so far"""
+        with self.__lock:
+            self.__load_entry_points()
+            return sorted(self.__modules)
+
+    def module(self, name):
+        """Returns the module implementing a name, imported on first use"""
+        with self.__lock:
+            module_path = self.__modules.get(name)
+            if module_path is None:
+                self.__load_entry_points()
+                module_path = self.__modules.get(name)
+            if module_path is None:
+                module_path = self.__find(name)
+
+            mod = self.__imports.get(module_path)
+            if mod is not None:
+                return mod[0]
+            started = time.perf_counter()
+            mod = importlib.import_module(module_path)
+            self.__imports[module_path] = (
+                mod, time.perf_counter() - started)
+            return mod
+
+    def resolve(self, name, attr='impt_class'):
+        """
+        Returns the class of a module as named by one of its attributes
+
+        Raises LookupError should the module lack the attribute or the
+        class it names, and ImportError should it not be importable.
+        """
+        key = (name, attr)
+        cls = self.__classes.get(key)
+        if cls is not None:
+            return cls
+
+        with self.__lock:
+            mod = self.module(name)
+            if not hasattr(mod, attr):
+                raise LookupError(
+                    "module {0} has no {1} attribute".format(name, attr))
+            cname = getattr(mod, attr)
+            if not hasattr(mod, cname):
+                raise LookupError(
+                    "module {0} has no {1} class implemented".format(
+                        name, cname))
+            cls = self.__classes[key] = getattr(mod, cname)
+            return cls
+
+    def report(self):
+        """
+        Returns the imports done so far as (module path, seconds) pairs,
+        slowest first, each one including the modules it imported itself
+        """
+        with self.__lock:
+            return sorted(
+                ((path, mod[1]) for path, mod in self.__imports.items()),
+                key=lambda r: r[1], reverse=True)
+
+    @staticmethod
+    def __find(name):
+        """Returns the path of a module declared nowhere"""
+        if '.' not in name:
+            for package in PACKAGES:
+                module_path = "{0}.{1}".format(package, name)
+                if importlib.util.find_spec(module_path) is not None:
+                    return module_path
+        return name
+
+    def __load_entry_points(self):
+        """Declares the modules of installed packages, looked up once"""
+        if self.__entry_points is not None:
+            return
+        self.__entry_points = {}
+        try:
+            from importlib.metadata import entry_points
+            eps = entry_points()
+            if hasattr(eps, 'select'):
+                eps = eps.select(group=ENTRY_POINT_GROUP)
+            else:
+                eps = eps.get(ENTRY_POINT_GROUP, ())
+        except ImportError:
+            return
+        for ep in eps:
+            # Entry points name modules, the class is named by them
+            self.__entry_points[ep.name] = ep.value.split(':')[0]
+            self.__modules.setdefault(ep.name, self.__entry_points[ep.name])
+
+
+# Registry shared by the controllers
+registry = BackendRegistry()
@@ -0,0 +1,128 @@
+"""
+Deadline based pacing shared by the emulators.
+
+Sleeping a fixed delay after every action lets the time spent on the
+action itself pile up as drift. The scheduler here rather keeps a
+timeline of absolute deadlines upon a monotonic clock, so the time spent
+in between two deadlines gets absorbed.
+"""
+import math
+import time
+
+
+class DeadlineScheduler(object):
+    """
+    Paces actions against absolute deadlines
+
+    Coarse sleeping is done by the OS up to a spin window before every
+    deadline, the rest of it is busy waited to reach sub-millisecond
+    targets. The lateness of every wake up is measured as jitter.
+    """
+
+    __DEFAULT_SPIN_WINDOW = 0.001
+    __DEFAULT_MAX_LAG = 0.5
+
+    def __init__(self, spin_window=None, max_lag=None):
+        self.__spin_window = (self.__DEFAULT_SPIN_WINDOW
+            if spin_window is None else float(spin_window))
+        self.__max_lag = (self.__DEFAULT_MAX_LAG
+            if max_lag is None else float(max_lag))
+        self.start()
+
+    def start(self):
+        """Anchors the timeline at the present and resets the jitter"""
+        self.__deadline = time.perf_counter()
+        self.__count = 0
+        self.__sum = 0.0
+        self.__sumsq = 0.0
+        self.__max = 0.0
+        self.__slips = 0
+
+    def wait(self, delay):
+        """
+        Waits until the next deadline, placed delay seconds after the last
+
+        A null delay just brings the timeline up to the present, as it
+        stands for acting as soon as possible. Falling behind the timeline
+        further than the maximum lag re-anchors it, rather than hurrying
+        the actions to come.
+        """
+        if not self.__advance(delay):
+            return
+        coarse = self.__deadline - time.perf_counter() - self.__spin_window
+        if coarse > 0:
+            time.sleep(coarse)
+        now = time.perf_counter()
+        while now < self.__deadline:
+            now = time.perf_counter()
+        self.__record(now)
+
+    def wait_until(self, deadline):
+        """
+        Waits until a deadline given as per time.perf_counter, which
+        becomes the one the next delays are placed after
+        """
+        self.__deadline = deadline
+        if deadline <= time.perf_counter():
+            return
+        coarse = deadline - time.perf_counter() - self.__spin_window
+        if coarse > 0:
+            time.sleep(coarse)
+        now = time.perf_counter()
+        while now < deadline:
+            now = time.perf_counter()
+        self.__record(now)
+
+    async def wait_async(self, delay):
+        """
+        Awaits until the next deadline, placed as per wait
+
+        The event loop does the sleeping so there is no busy waiting,
+        hence targets are as accurate as the loop timer.
+        """
+        # Synchronous users are spared the import of asyncio
+        import asyncio
+
+        if not self.__advance(delay):
+            return
+        remaining = self.__deadline - time.perf_counter()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        self.__record(time.perf_counter())
+
+    def __advance(self, delay):
+        """Moves the deadline ahead, telling whether it is worth waiting"""
+        if delay <= 0:
+            self.__deadline = max(self.__deadline, time.perf_counter())
+            return False
+        self.__deadline += delay
+        return True
+
+    def __record(self, now):
+        """Accounts for the lateness of a wake up"""
+        lateness = now - self.__deadline
+        self.__count += 1
+        self.__sum += lateness
+        self.__sumsq += lateness * lateness
+        self.__max = max(self.__max, lateness)
+
+        if lateness > self.__max_lag:
+            self.__slips += 1
+            self.__deadline = now
+
+    def jitter(self):
+        """
+        Returns the jitter measured since the timeline was anchored
+
+        Figures are in seconds, slips counts the times the timeline got
+        re-anchored for lagging behind.
+        """
+        mean = self.__sum / self.__count if self.__count else 0.0
+        var = self.__sumsq / self.__count - mean * mean if self.__count else 0.0
+        return {
+            'count': self.__count,
+            'mean': mean,
+            'max': self.__max,
+            'stdev': math.sqrt(max(var, 0.0)),
+            'slips': self.__slips,
+        }
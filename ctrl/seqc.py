@@ -0,0 +1,354 @@
+"""
+Ahead of time compiler for keyboard sequences.
+
+Both sequence formats understood by the keyboard emulators are lowered
+into one compact intermediate representation, a flat list of operations:
+
+    (IR_TEXT, "hola")      text to be typed key by key
+    (IR_KEY, "ENTER")      a named key
+    (IR_MOD, "SHIFT_L")    toggle of a modifier key
+    (IR_PACE, 0.5)         delay to keep after every key from now on
+    (IR_WAIT, 1.0)         one-off delay
+
+Compiled sequences are cached on disk keyed by the hash of their source,
+so replaying a sequence costs no parsing at all.
+"""
+import codecs
+import collections
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+
+from ctrl.gen import KbSeqError
+
+IR_TEXT, IR_KEY, IR_MOD, IR_PACE, IR_WAIT = range(5)
+
+
+# Tokenizer states upon the text format of sequences
+(_LINE_START, _HEAD, _NORMAL, _SPECIAL, _TEXT, _TEXT_ESC,
+    _COMMENT, _DELAY) = range(8)
+
+# Characters ending a run of text
+_TEXT_STOP = re.compile(r'["\\\n]')
+
+# Longest special key name or DELAY line to be buffered
+_MAX_TOKEN_LEN = 256
+
+
+def tokenize_seq(source, seq_name, modifiers=(), keys=None, chunk_size=4096):
+    """
+    Streams the operations of a sequence in text format off a file-like
+
+    The source might be a file, stdin, a pipe or a socket made file, either
+    in text or binary mode, since it is read a chunk at a time whatever is
+    available. Memory use does not depend on the length of the input and
+    operations are yielded as soon as they are recognized, hence a long
+    text is yielded in several pieces.
+
+    The format consists of lines holding "quoted text", <SPECIAL> keys and
+    # comments, or else a lonely DELAY = <seconds> setting. Should the keys
+    known by the emulator be given, any other one is an error reported at
+    the line and column it is found.
+    """
+    if keys is not None:
+        keys = frozenset(keys)
+    raw = getattr(source, 'buffer', source)
+    read = getattr(raw, 'read1', None) or raw.read
+    decoder = None
+
+    state = _LINE_START
+    line, line_pos, pos = 1, 0, 0
+    mark = (1, 1)   # where the construct being parsed started
+    stray = None    # whitespace not yet known to be trailing
+    buf = []
+
+    def fail(where, desc):
+        raise KbSeqError(
+            "Error in file {0} on line {1}, column {2}: {3}".format(
+                seq_name, where[0], where[1], desc))
+
+    def delay_of(delay_line):
+        try:
+            return float(delay_line.split('=')[1].strip())
+        except (ValueError, IndexError):
+            fail(mark, "'{0}' not a number".format(delay_line[6:].strip()))
+
+    while True:
+        data = read(chunk_size)
+        eof = not data
+        chunk = data
+        if isinstance(data, bytes):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            try:
+                chunk = decoder.decode(data, final=eof)
+            except UnicodeDecodeError:
+                fail((line, pos - line_pos + 1), "not utf-8 text")
+        if eof:
+            # The last line is ended as if there was a newline
+            chunk += "\n"
+
+        i, n = 0, len(chunk)
+        while i < n:
+            ch = chunk[i]
+            here = (line, pos + i - line_pos + 1)
+
+            if state == _TEXT:
+                m = _TEXT_STOP.search(chunk, i)
+                end = m.start() if m else n
+                if end > i:
+                    run = chunk[i:end]
+                    if keys is not None and not keys.issuperset(run):
+                        j = next(j for j, c in enumerate(run) if c not in keys)
+                        fail((line, pos + i + j - line_pos + 1),
+                            "Couldn't translate key: '{0}'".format(run[j]))
+                    buf.append(run)
+                    i = end
+                    continue
+                if ch == "\"":
+                    if buf:
+                        yield (IR_TEXT, ''.join(buf))
+                        buf = []
+                    state = _NORMAL
+                elif ch == "\\":
+                    # Allow sending ", by using '\'
+                    state = _TEXT_ESC
+                else:
+                    fail(mark, "Didn't find closing \"")
+
+            elif state == _TEXT_ESC:
+                if ch == "\n":
+                    fail(mark, "Didn't find closing \"")
+                if keys is not None and ch not in keys:
+                    fail(here, "Couldn't translate key: '{0}'".format(ch))
+                buf.append(ch)
+                state = _TEXT
+
+            elif ch == "\n":
+                if state == _SPECIAL:
+                    fail(mark, "Didn't find closing '>'")
+                if state == _HEAD:
+                    fail(mark, "Found 'D' outside of <> and \"\"")
+                if state == _DELAY:
+                    yield (IR_PACE, delay_of(''.join(buf).strip()))
+                buf = []
+                stray = None
+                state = _LINE_START
+                line += 1
+                line_pos = pos + i + 1
+
+            elif state == _COMMENT:
+                end = chunk.find("\n", i)
+                i = n if end < 0 else end
+                continue
+
+            elif state == _SPECIAL:
+                if ch == ">":
+                    special = ''.join(buf)
+                    buf = []
+                    if (keys is not None and special not in modifiers
+                            and special not in keys):
+                        fail(mark, "Couldn't translate key: <{0}>".format(
+                            special))
+                    yield (IR_MOD if special in modifiers else IR_KEY, special)
+                    state = _NORMAL
+                elif len(buf) < _MAX_TOKEN_LEN:
+                    buf.append(ch)
+                else:
+                    fail(mark, "Didn't find closing '>'")
+
+            elif state == _DELAY:
+                if len(buf) > _MAX_TOKEN_LEN:
+                    fail(mark, "'{0}' not a number".format(
+                        ''.join(buf)[6:].strip()))
+                buf.append(ch)
+
+            elif state == _HEAD:
+                # Anything else but a DELAY setting at the start of a
+                # line is an error, so five letters suffice to tell
+                buf.append(ch)
+                if not "DELAY".startswith(''.join(buf)):
+                    fail(mark, "Found 'D' outside of <> and \"\"")
+                if len(buf) == 5:
+                    state = _DELAY
+
+            elif ch == " " or (ch.isspace() and state == _LINE_START):
+                pass
+
+            elif ch.isspace():
+                stray = stray or (here, ch)
+
+            elif state == _LINE_START and ch == "D":
+                mark = here
+                buf = [ch]
+                state = _HEAD
+
+            else:
+                if stray:
+                    fail(stray[0], "Found '{0}' outside of <> and \"\"".format(
+                        stray[1]))
+                if ch == "<":
+                    mark = here
+                    state = _SPECIAL
+                elif ch == "\"":
+                    mark = here
+                    state = _TEXT
+                elif ch == "#":
+                    state = _COMMENT
+                else:
+                    fail(here, "Found '{0}' outside of <> and \"\"".format(ch))
+
+            i += 1
+
+        if eof:
+            return
+
+        pos += n
+        if state == _TEXT and buf:
+            yield (IR_TEXT, ''.join(buf))
+            buf = []
+
+
+def parse_seq(content, seq_name, modifiers=(), keys=None):
+    """
+    Lowers the text format of sequences as a whole
+    """
+    return list(tokenize_seq(io.StringIO(content), seq_name, modifiers, keys))
+
+
+def parse_ktasks(content, seq_name, modifiers=(), keys=None):
+    """
+    Lowers the json format of sequences holding a list of ktasks
+
+    Every task types its _inst as many _times as requested, keeping
+    a _time_gap after each one. Keys are not checked here, as tasks carry
+    no position to report, but upon lowering.
+    """
+    ir = []
+    try:
+        for task in json.loads(content)['ktasks']:
+            task['_desc']
+            counter = int(task.get('_times', '1'))
+            time_gap = float(task.get('_time_gap', '1'))
+            inst = task['_inst']
+            ir.extend([(IR_TEXT, inst), (IR_WAIT, time_gap)] * counter)
+    except (KeyError, TypeError, ValueError):
+        raise KbSeqError(
+            "sequence badly conformed in file {0}".format(seq_name))
+    return ir
+
+
+class SeqCompiler(object):
+    """
+    Compiles sequence files into the intermediate representation
+
+    The last compilations are held in memory, the newest one per file
+    path as long as its modification time and size match, whilst the
+    disk cache is keyed by file content.
+    """
+
+    __VERSION = 2
+    __DEFAULT_CACHE_DIR = os.path.join(
+        os.path.expanduser("~"), ".cache", "mimic", "seq")
+    __DIALECTS = {
+        'seq': parse_seq,
+        'ktasks': parse_ktasks,
+    }
+
+    # Compilations held in memory, least recently used first
+    __MEMO_SIZE = 256
+    __memo = collections.OrderedDict()
+    __memo_lock = threading.Lock()
+
+    def __init__(self, logger, cache_dir=None):
+        self.__logger = logger
+        self.__cache_dir = cache_dir or self.__DEFAULT_CACHE_DIR
+
+    def __call__(self, seq_file, dialect, modifiers=(), keys=None):
+        """
+        Returns the digest of a sequence file along with its compilation
+
+        Args:
+            seq_file: Path to the sequence file.
+            dialect: Either 'seq' or 'ktasks'.
+            modifiers: Special key names to be lowered as modifiers.
+            keys: Keys known by the emulator, any other one being an error.
+        """
+        if dialect not in self.__DIALECTS:
+            raise KbSeqError("unknown sequence dialect {0}".format(dialect))
+
+        seq_path = os.path.abspath(seq_file)
+        st = os.stat(seq_path)
+        keys = None if keys is None else frozenset(keys)
+        memo_key = (seq_path, dialect, frozenset(modifiers), keys)
+        stamp = (st.st_mtime_ns, st.st_size)
+
+        with self.__memo_lock:
+            memo = self.__memo.get(memo_key)
+            if memo is not None and memo[0] == stamp:
+                self.__memo.move_to_end(memo_key)
+                return memo[1]
+
+        with open(seq_path, "rb") as sf:
+            raw = sf.read()
+
+        h = hashlib.sha1(raw)
+        h.update("{0}:{1}:{2}".format(
+            self.__VERSION, dialect, ",".join(sorted(modifiers))).encode())
+        if keys is not None:
+            # Compilations checked against other keys are not reused
+            h.update("\0".join(sorted(keys)).encode())
+        digest = h.hexdigest()
+
+        ir = self.__load(digest)
+        if ir is None:
+            self.__logger.debug("compiling sequence {0}".format(seq_path))
+            try:
+                content = raw.decode("utf-8")
+            except UnicodeDecodeError:
+                raise KbSeqError(
+                    "sequence file {0} is not utf-8 text".format(seq_path))
+            ir = self.__DIALECTS[dialect](content, seq_path, modifiers, keys)
+            self.__store(digest, ir)
+
+        with self.__memo_lock:
+            # Compilations of former versions of the file are replaced
+            self.__memo[memo_key] = (stamp, (digest, ir))
+            self.__memo.move_to_end(memo_key)
+            while len(self.__memo) > self.__MEMO_SIZE:
+                self.__memo.popitem(last=False)
+        return digest, ir
+
+    def __cache_path(self, digest):
+        return os.path.join(self.__cache_dir, "{0}.json".format(digest))
+
+    def __load(self, digest):
+        """Reads a compilation from disk cache if it is there"""
+        try:
+            with open(self.__cache_path(digest)) as cf:
+                return [tuple(op) for op in json.load(cf)]
+        except (OSError, ValueError):
+            return None
+
+    def __store(self, digest, ir):
+        """Writes a compilation onto disk cache, replacing it atomically"""
+        try:
+            os.makedirs(self.__cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.__cache_dir)
+            try:
+                with os.fdopen(fd, "w") as cf:
+                    json.dump(ir, cf, separators=(',', ':'))
+                os.replace(tmp_path, self.__cache_path(digest))
+            except BaseException:
+                # Half written compilations are not left behind
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            # Running without disk cache is not a reason to fail
+            self.__logger.debug(
+                "sequence cache {0} not writable: {1}".format(
+                    self.__cache_dir, e))
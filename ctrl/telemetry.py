@@ -0,0 +1,145 @@
+"""
+Telemetry sampling of the power switches.
+
+Readings such as the current drawn and the temperature are polled by a
+background thread at a fixed rate and kept in a columnar ring buffer,
+one preallocated array per channel plus one of timestamps, so sampling
+costs no allocations and old samples get overwritten. Samples might be
+downsampled into min/max/mean buckets or exported as CSV.
+"""
+import csv
+import threading
+import time
+from array import array
+
+
+class TelemetryRing(object):
+    """
+    Ring buffer holding the last samples of a set of channels
+
+    Timestamps are seconds since the epoch, values are floats.
+    """
+
+    __DEFAULT_SIZE = 86400
+
+    def __init__(self, channels, size=None):
+        self.channels = tuple(channels)
+        self.__size = int(size or self.__DEFAULT_SIZE)
+        self.__ts = array('d', bytes(8 * self.__size))
+        self.__cols = tuple(
+            array('d', bytes(8 * self.__size)) for c in self.channels)
+        self.__next = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.__next, self.__size)
+
+    def append(self, ts, values):
+        """Overwrites the oldest sample with values ordered as channels"""
+        with self.__lock:
+            i = self.__next % self.__size
+            self.__ts[i] = ts
+            for col, v in zip(self.__cols, values):
+                col[i] = v
+            self.__next += 1
+
+    def samples(self, since=None):
+        """
+        Returns the samples held, oldest first, as (timestamp, values)
+        tuples, only those taken from since onwards if given
+        """
+        with self.__lock:
+            first = max(0, self.__next - self.__size)
+            rows = [
+                (self.__ts[i % self.__size],
+                    tuple(col[i % self.__size] for col in self.__cols))
+                for i in range(first, self.__next)
+            ]
+        if since is not None:
+            rows = [r for r in rows if r[0] >= since]
+        return rows
+
+    def downsample(self, interval, since=None):
+        """
+        Folds the samples into buckets of interval seconds
+
+        Returns a list of (bucket start, sample count, stats) tuples where
+        stats holds a (min, max, mean) tuple per channel.
+        """
+        buckets = []
+        for ts, values in self.samples(since):
+            start = ts - ts % interval
+            if not buckets or buckets[-1][0] != start:
+                buckets.append([start, 0, [[v, v, 0.0] for v in values]])
+            bucket = buckets[-1]
+            bucket[1] += 1
+            for acc, v in zip(bucket[2], values):
+                acc[0] = min(acc[0], v)
+                acc[1] = max(acc[1], v)
+                acc[2] += v
+        return [
+            (start, n, tuple((lo, hi, total / n) for lo, hi, total in stats))
+            for start, n, stats in buckets
+        ]
+
+    def to_csv(self, csv_file, since=None):
+        """Writes the samples into a path or a file-like, header first"""
+        if isinstance(csv_file, str):
+            with open(csv_file, 'w', newline='') as cf:
+                return self.to_csv(cf, since)
+        writer = csv.writer(csv_file)
+        writer.writerow(('timestamp',) + self.channels)
+        for ts, values in self.samples(since):
+            writer.writerow(('{0:.6f}'.format(ts),) + values)
+
+
+class TelemetrySampler(object):
+    """
+    Background poller of readings into a TelemetryRing
+
+    The read callable returns a dict holding a value per channel. Polls
+    are paced upon absolute deadlines; failed ones are counted and logged
+    without stopping the sampler.
+    """
+
+    __DEFAULT_PERIOD = 1.0
+
+    def __init__(self, logger, read, channels, period=None, size=None):
+        self.logger = logger
+        self.__read = read
+        self.period = float(period or self.__DEFAULT_PERIOD)
+        self.ring = TelemetryRing(channels, size)
+        self.errors = 0
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        if self.__thread:
+            return
+        self.__stop.clear()
+        self.__thread = threading.Thread(
+            target=self.__sample, name="telemetry", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+
+    def __sample(self):
+        deadline = time.monotonic()
+        while not self.__stop.is_set():
+            try:
+                reading = self.__read()
+                self.ring.append(
+                    time.time(), [reading[c] for c in self.ring.channels])
+            except Exception as e:
+                self.errors += 1
+                self.logger.warning("telemetry sample failed: {0}".format(e))
+            deadline += self.period
+            now = time.monotonic()
+            if deadline < now:
+                # Polls taking longer than the period are not caught up
+                deadline = now
+            self.__stop.wait(deadline - now)
@@ -0,0 +1,149 @@
+"""
+Hot path instrumentation for the emulators.
+
+Timestamps are kept in a fixed size ring buffer and latencies in
+histograms, both backed by arrays preallocated up front, so recording
+costs neither allocations nor formatting. Figures are dumped on demand.
+"""
+import time
+from array import array
+
+
+class TraceRing(object):
+    """
+    Ring buffer holding the last (timestamp, event, value) records
+
+    Events are small integers indexing the names the ring was built with.
+    """
+
+    __DEFAULT_SIZE = 4096
+
+    def __init__(self, events, size=None):
+        self.__events = tuple(events)
+        self.__size = int(size or self.__DEFAULT_SIZE)
+        self.__ts = array('d', bytes(8 * self.__size))
+        self.__ev = array('B', bytes(self.__size))
+        self.__val = array('d', bytes(8 * self.__size))
+        self.__next = 0
+
+    def record(self, event, value=0.0, ts=None):
+        """Overwrites the oldest record"""
+        i = self.__next % self.__size
+        self.__ts[i] = time.perf_counter() if ts is None else ts
+        self.__ev[i] = event
+        self.__val[i] = value
+        self.__next += 1
+
+    def dump(self):
+        """Returns the records held, oldest first, with events named"""
+        first = max(0, self.__next - self.__size)
+        return [
+            (self.__ts[i % self.__size], self.__events[self.__ev[i % self.__size]],
+                self.__val[i % self.__size])
+            for i in range(first, self.__next)
+        ]
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies upon power of two buckets of microseconds
+
+    Bucket zero holds latencies below 1 us, bucket i those within
+    [2^(i-1), 2^i) us, the last one holds whatever lies beyond.
+    """
+
+    __BUCKETS = 32
+
+    def __init__(self):
+        self.__counts = array('Q', bytes(8 * self.__BUCKETS))
+        self.reset()
+
+    def reset(self):
+        for i in range(self.__BUCKETS):
+            self.__counts[i] = 0
+        self.__n = 0
+        self.__sum = 0.0
+        self.__min = float('inf')
+        self.__max = 0.0
+
+    def add(self, seconds):
+        us = int(seconds * 1e6)
+        self.__counts[min(us.bit_length(), self.__BUCKETS - 1)] += 1
+        self.__n += 1
+        self.__sum += seconds
+        if seconds < self.__min:
+            self.__min = seconds
+        if seconds > self.__max:
+            self.__max = seconds
+
+    def percentile(self, p):
+        """Upper bound in seconds of the bucket holding the percentile"""
+        if not self.__n:
+            return 0.0
+        rank = p / 100.0 * self.__n
+        seen = 0
+        for i, c in enumerate(self.__counts):
+            seen += c
+            if seen >= rank and c:
+                return min((1 << i) / 1e6, self.__max)
+        return self.__max
+
+    def summary(self):
+        """Returns the figures of the histogram, latencies in seconds"""
+        return {
+            'count': self.__n,
+            'min': self.__min if self.__n else 0.0,
+            'max': self.__max,
+            'mean': self.__sum / self.__n if self.__n else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': list(self.__counts),
+        }
+
+
+class KbTrace(object):
+    """
+    Instrumentation of keyboard emulators
+
+    Keeps a histogram per latency kind along a run, plus the ring buffer
+    of the latest records across runs.
+    """
+
+    TRANSLATE, WRITE, GAP = range(3)
+    __KINDS = ('translate', 'write', 'gap')
+
+    def __init__(self, size=None):
+        self.__ring = TraceRing(self.__KINDS, size)
+        self.__hists = tuple(LatencyHistogram() for k in self.__KINDS)
+        self.__last_write = None
+
+    def start(self):
+        """Starts a run afresh"""
+        for h in self.__hists:
+            h.reset()
+        self.__last_write = None
+
+    def record(self, kind, started):
+        """
+        Records a latency of the kind given, measured since started as per
+        time.perf_counter
+        """
+        now = time.perf_counter()
+        self.__hists[kind].add(now - started)
+        self.__ring.record(kind, now - started, now)
+
+    def write(self, started):
+        """Records a write, along with the gap since the previous one"""
+        self.record(self.WRITE, started)
+        if self.__last_write is not None:
+            self.__hists[self.GAP].add(started - self.__last_write)
+            self.__ring.record(self.GAP, started - self.__last_write, started)
+        self.__last_write = started
+
+    def histograms(self):
+        """Returns the summary of the histograms by kind of latency"""
+        return {k: h.summary() for k, h in zip(self.__KINDS, self.__hists)}
+
+    def dump(self):
+        """Returns the records held by the ring buffer"""
+        return self.__ring.dump()
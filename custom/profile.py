@@ -1,30 +1,126 @@
 import logging
 import os
 import json
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
 
-class ProfileTree:
+
+def _freeze(data):
+    """Turns parsed json into read-only mappings and tuples"""
+    if isinstance(data, Mapping):
+        return MappingProxyType({k: _freeze(v) for k, v in data.items()})
+    if isinstance(data, (list, tuple)):
+        return tuple(_freeze(v) for v in data)
+    return data
+
+
+def _thaw(data):
+    """Turns frozen data back into plain dicts and lists"""
+    if isinstance(data, Mapping):
+        return {k: _thaw(v) for k, v in data.items()}
+    if isinstance(data, tuple):
+        return [_thaw(v) for v in data]
+    return data
+
+
+class ProfileTree(object):
     """
+    Node of a profile, compiled once into immutable nodes
+
+    Every child is compiled upon construction. Mappings become instances
+    of a class whose __slots__ are named after their fields, shared by
+    mappings of the same shape, so fields are reached as plain slot
+    attributes. Fields whose names are not fit for a slot are looked up
+    instead, and fields of a list collect those of its items. The
+    content stays reachable, read-only, as data. Names starting with a
+    double underscore are never looked up as fields.
     """
-    def __init__(self, data):
-        self.data=data
+
+    __slots__ = ('data', '__children', '__collected')
+
+    __shapes = {}
+
+    def __new__(cls, data, _frozen=False):
+        if not _frozen:
+            data = _freeze(data)
+        init = object.__setattr__
+        if isinstance(data, Mapping):
+            children = {k: ProfileTree(v, True) for k, v in data.items()}
+            fields = tuple(k for k in children if ProfileTree.__slotted(k))
+            node = object.__new__(ProfileTree.__shape(fields))
+            for k in fields:
+                init(node, k, children[k])
+            collected = None
+        elif isinstance(data, tuple):
+            node = object.__new__(cls)
+            children = tuple(ProfileTree(v, True) for v in data)
+            collected = {}
+        else:
+            node = object.__new__(cls)
+            children = collected = None
+        init(node, 'data', data)
+        init(node, '_ProfileTree__children', children)
+        init(node, '_ProfileTree__collected', collected)
+        return node
+
+    @staticmethod
+    def __slotted(key):
+        return (isinstance(key, str) and key.isidentifier() and
+            not key.startswith('__') and not hasattr(ProfileTree, key))
+
+    @staticmethod
+    def __shape(fields):
+        """Returns the class of the mappings holding the fields given"""
+        shape = ProfileTree.__shapes.get(fields)
+        if shape is None:
+            shape = type('ProfileTree', (ProfileTree,), {'__slots__': fields})
+            ProfileTree.__shapes[fields] = shape
+        return shape
 
     def __getattr__(self, key):
 
+        if key.startswith('__'):
+            raise AttributeError(key)
+
+        children = self.__children
+        if type(children) is dict:
+            return children[key]
+
+        collected = self.__collected
+        if collected is None:
+            return ProfileTree((), True)
         try:
-            return ProfileTree(self.data[key])
-        except TypeError:
-            result=[]
-            for item in self.data:
-                if key in item:
-                    try:
-                        result.append(item[key])
-                    except TypeError: pass
-            return ProfileTree(result)
+            return collected[key]
+        except KeyError:
+            result = ProfileTree(tuple(
+                item[key] for item in self.data
+                if isinstance(item, Mapping) and key in item), True)
+            collected[key] = result
+            return result
 
     def __getitem__(self, key):
 
+        if self.__children is not None:
+            return self.__children[key]
         return ProfileTree(self.data[key])
 
+    def __setattr__(self, key, value):
+        raise AttributeError("profile nodes are immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError("profile nodes are immutable")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # Shape classes are not reachable by name, so nodes get rebuilt
+        return (ProfileTree, (_thaw(self.data),))
+
     def __iter__(self):
 
         if isinstance(self.data, str):
@@ -42,13 +138,23 @@ class ProfileTree:
     def __length_hint__(self):
         return len(self.data)
 
+    def __repr__(self):
+        return "ProfileTree({0!r})".format(self.data)
+
 
 class ProfileReader(object):
     """
+    Reader of profiles in json format
+
+    Profiles are compiled once per process and shared, as they are
+    immutable, until their file gets modified.
     """
 
     PNODE_UNIQUE, PNODE_MANY = range(2)
 
+    __cache = {}
+    __cache_lock = threading.Lock()
+
     def __init__(self, logger):
         self.__logger = logger
 
@@ -70,14 +176,28 @@ class ProfileReader(object):
                 )
                 raise
 
+        p_abs_path = os.path.abspath(p_file_path)
         try:
-            return ProfileTree(parse_profile())
-        except:
-            raise
+            st = os.stat(p_abs_path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+
+        with self.__cache_lock:
+            cached = self.__cache.get(p_abs_path)
+        if stamp and cached and cached[0] == stamp:
+            return cached[1]
+
+        tree = ProfileTree(parse_profile())
+        if stamp:
+            with self.__cache_lock:
+                self.__cache[p_abs_path] = (stamp, tree)
+        return tree
 
     @staticmethod
     def get_content(pt_node, flavor):
-        return [
-            lambda : list(pt_node)[0],
-            lambda : list(pt_node)
-        ][flavor]()
+        if flavor == ProfileReader.PNODE_UNIQUE:
+            for item in pt_node:
+                return item
+            raise IndexError("profile node holds no content")
+        return list(pt_node)